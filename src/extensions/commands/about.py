@@ -231,7 +231,7 @@ class AboutCommand(Extension):
 			),
 			EmbedField(
 				name=await lformat(stats_loc, stats_loc.l("fields.server_count.name")),
-				value=str(ctx.client.guild_count),
+				value=str(ctx.client.guild_count if sys_stats.guilds is None else sys_stats.guilds),
 				inline=True,
 			),
 			EmbedField(
@@ -5,7 +5,6 @@ import time
 import traceback as tb
 from traceback import print_exc
 
-import aiohttp
 from aioconsole import aexec
 from interactions import (
 	Embed,
@@ -154,9 +153,7 @@ class MiscellaneousCommands(Extension):
 			embed.set_footer(await lformat(loc, loc.l("misc.miaou.finding.footer")))
 			return await ctx.send(embed=embed)
 
-		async with aiohttp.ClientSession() as session:
-			async with session.get("https://api.thecatapi.com/v1/images/search") as response:
-				data = await response.json()
+		data = await fetch("https://api.thecatapi.com/v1/images/search", output="json", ignore_status=True)
 
 		image = data[0]["url"]
 
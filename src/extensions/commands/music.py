@@ -5,7 +5,6 @@ import time
 import uuid
 from urllib import parse
 
-import aiohttp
 import lavalink
 from interactions import *
 from interactions.api.events import *
@@ -16,6 +15,7 @@ from utilities.config import get_config
 from utilities.emojis import emojis
 from utilities.localization.localization import Localization
 from utilities.message_decorations import *
+from utilities.misc import fetch
 from utilities.music.music_loaders import CustomSearch
 
 # Utilities
@@ -713,9 +713,7 @@ class MusicCommands(Extension):
 
 		api_url = f"https://some-random-api.com/lyrics?title={parsed_title}"
 
-		async with aiohttp.ClientSession() as lyricsSession:
-			async with lyricsSession.get(api_url) as jsondata:
-				lyric_data: dict = await jsondata.json()
+		lyric_data: dict = await fetch(api_url, output="json", ignore_status=True)
 
 		if "error" in lyric_data.keys():
 			return await ctx.send(
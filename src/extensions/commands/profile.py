@@ -28,6 +28,7 @@ from utilities.message_decorations import Colors, emojis, fancy_message
 from utilities.misc import fetch
 from utilities.profile.main import draw_profile
 from utilities.textbox.mediagen import Frame, render_textbox_frames
+from utilities.textbox.render_pool import RenderQueueFull
 
 
 class ProfileCommands(Extension):
@@ -154,9 +155,11 @@ class ProfileCommands(Extension):
 					url=get_config("bot.links.discord-invite"),
 				)
 			)
-			buffer = await render_textbox_frames(
-				[Frame(str(await lformat(loc, loc.l("profile.edit.down"))))], loops=1, loc=loc
-			)
+			down = await lformat(loc, loc.l("profile.edit.down"))
+			try:
+				buffer = await render_textbox_frames([Frame(str(down))], loops=1, loc=loc, owner=ctx.user.id)
+			except RenderQueueFull:
+				return await ctx.edit(content=down, embeds=[], components=components)
 			filename = (
 				await lformat(
 					loc,
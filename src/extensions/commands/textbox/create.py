@@ -47,7 +47,9 @@ from utilities.misc import (
 	sanitize_filename,
 )
 from utilities.textbox.facepics import f_storage
-from utilities.textbox.mediagen import Frame, SupportedFiletypes, render_textbox_frames
+from utilities.textbox.mediagen import Frame, SupportedFiletypes, render_error, render_textbox_frames
+from utilities.textbox.render_pool import RenderQueueFull
+from utilities.textbox.renderer import OutputTooLarge
 from utilities.textbox.states import (
 	State,
 	StateOptions,
@@ -257,7 +259,12 @@ async def send_output(
 	)
 
 	start = datetime.now()
-	file = await render_to_file(ctx, state)
+	try:
+		file = await render_to_file(ctx, state)
+	except (RenderQueueFull, OutputTooLarge) as e:
+		return await ctx.edit(
+			message=message, embed=Embed(description=await render_error(loc, e), color=Colors.DARKER_WHITE)
+		)
 	end = datetime.now()
 	took = start - end
 
@@ -332,7 +339,9 @@ async def render_to_file(
 		timestamp=str(round(datetime.now().timestamp())),
 	)
 
-	buffer = await render_textbox_frames(frames, state.options.quality, filetype, loops=state.options.loops, loc=loc)
+	buffer = await render_textbox_frames(
+		frames, state.options.quality, filetype, loops=state.options.loops, loc=loc, owner=ctx.user.id
+	)
 	buffer.seek(0)
 	filename = filename + ("" if filetype == "APNG" else "." + filetype)
 
@@ -475,21 +484,27 @@ async def respond(
 		next_frame_exists = len(state.frames) != int(frame_index) + 1
 		print(state)
 
-		preview = await render_to_file(ctx, state, frame_preview_index=int(frame_index))
-		filename = sanitize_filename(preview.file_name or "meow")
+		preview: File | None = None
+		try:
+			preview = await render_to_file(ctx, state, frame_preview_index=int(frame_index))
+		except (RenderQueueFull, OutputTooLarge) as e:
+			# the editor still works without the preview
+			pos = f"\n-# {await render_error(loc, e)}{pos}"
+		filename = sanitize_filename((preview and preview.file_name) or "meow")
 		tbb = File(
 			file=io.BytesIO((await state.to_string(loc)).encode("utf-8")),
 			file_name=filename.rsplit(".", maxsplit=1)[0] + ".backup.tbb",
 		)
-		files.extend([tbb, preview])
+		files.append(tbb)
+		if preview is not None:
+			files.append(preview)
+		components.append(FileComponent(file=UnfurledMediaItem(url=f"attachment://{tbb.file_name}")))
+		if preview is not None:
+			components.append(
+				MediaGalleryComponent(items=[MediaGalleryItem(media=UnfurledMediaItem(url=f"attachment://{filename}"))])
+			)
 		components.extend(
 			[
-				FileComponent(file=UnfurledMediaItem(url=f"attachment://{tbb.file_name}")),
-				MediaGalleryComponent(
-					items=[
-						MediaGalleryItem(media=UnfurledMediaItem(url=f"attachment://{filename}")),
-					]
-				),
 				ActionRow(
 					Button(
 						style=ButtonStyle.BLURPLE,
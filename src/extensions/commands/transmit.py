@@ -1,4 +1,5 @@
 import asyncio
+import time
 import uuid
 from typing import Literal
 
@@ -25,23 +26,27 @@ from interactions.api.events import Component, MessageCreate
 
 from utilities.database.schemas import ServerData
 from utilities.emojis import emojis
-from utilities.localization.formatting import ftime
-from utilities.localization.localization import Localization, lformat
 from utilities.message_decorations import Colors, fancy_message
 from utilities.profile.badge_manager import increment_value
+from utilities.timer_wheel import timer_wheel
 from utilities.transmission_connection_manager import (
 	Connection,
 	Transmission,
-	available_initial_connections,
-	connect_to_transmission,
 	connection_alive,
-	create_connection,
+	end_transmission,
+	get_channel_transmission,
 	get_transmission,
-	remove_connection,
+	relay_message,
+	set_relay,
+	start_transmission,
 )
 
 
 class TransmissionCommands(Extension):
+	def __init__(self, client):
+		self.client = client
+		set_relay(self.deliver)
+
 	@slash_command(description="Transmit to other servers!")
 	@integration_types(guild=True, user=False)
 	@contexts(bot_dm=False)
@@ -199,9 +204,9 @@ class TransmissionCommands(Extension):
 		if trans:
 			return await fancy_message(ctx, "[ This server is already transmitting! ]", ephemeral=True)
 
-		if available_initial_connections(server_data.transmissions.blocked_servers):
-			trans = create_connection(ctx.guild_id, ctx.channel_id)
-
+		# claimed right away, so nobody else can take the same waiting server while this one sends its message
+		trans = await start_transmission(ctx.guild_id, ctx.channel_id, server_data.transmissions.blocked_servers)
+		if not trans.connected.is_set():
 			embed = await self.embed_manager("initial_connection")
 
 			cancel = Button(
@@ -213,14 +218,18 @@ class TransmissionCommands(Extension):
 			msg = await ctx.send(embeds=embed, components=cancel)
 
 			task = asyncio.create_task(ctx.client.wait_for_component(components=cancel))
-
-			while not connection_alive(trans):
-				done, _ = await asyncio.wait({task}, timeout=1)
-
-				if not done:
-					continue
-
-				remove_connection(trans)
+			connected = asyncio.create_task(trans.connected.wait())
+			ended = asyncio.create_task(trans.ended.wait())
+
+			await asyncio.wait({task, connected, ended}, return_when=asyncio.FIRST_COMPLETED)
+			ended.cancel()
+			if not trans.connected.is_set():
+				connected.cancel()
+				if trans.ended.is_set():  # the wait was lost, like when the bot loses the transmission broker
+					task.cancel()
+					await msg.edit(embeds=make_cancel_embed("lost", ctx.guild.name), components=[])
+					return
+				await end_transmission(trans)
 
 				button_ctx: Component = task.result()
 
@@ -230,6 +239,7 @@ class TransmissionCommands(Extension):
 
 				await msg.edit(embeds=embed, components=[])
 				return
+			task.cancel()
 
 			await increment_value(ctx, "times_transmitted", 1, ctx.user)
 
@@ -243,7 +253,6 @@ class TransmissionCommands(Extension):
 
 		await increment_value(ctx, "times_transmitted", 1, ctx.user)
 
-		connect_to_transmission(ctx.guild_id, ctx.channel_id)
 		await self.on_transmission(ctx, msg)
 		return
 
@@ -252,37 +261,24 @@ class TransmissionCommands(Extension):
 		server_id = ctx.guild_id
 		if not server_id:
 			return
-		loc = Localization(ctx)
 		trans: Transmission | None = get_transmission(server_id)
 		if not trans:
 			return
 		if (
-			not connection_alive(trans) or trans.connection_b is None
-		):  # NOTE: part after "or" is for python linter i'm not sure why it says that connection_b may be null 5 lines below
+			not connection_alive(trans) or trans.peer is None
+		):  # NOTE: part after "or" is for python linter i'm not sure why it says that peer may be null 5 lines below
 			return
 
 		other_server: Guild | None
-		if server_id == trans.connection_a.server_id:
-			other_server = await self.client.fetch_guild(trans.connection_b.server_id)
-		else:
-			other_server = await self.client.fetch_guild(trans.connection_a.server_id)
+		_, other_server = await asyncio.gather(
+			trans.connection.load(self.client), self.client.fetch_guild(trans.peer.server_id)
+		)
 		if not other_server:
 			return
 
 		server_data: ServerData = await ServerData(_id=server_id).fetch()
 		await server_data.transmissions.known_servers.append(str(other_server.id))
 
-		guilds = [
-			await ctx.client.fetch_guild(id) or id
-			for id in list(set(server_data.transmissions.known_servers + server_data.transmissions.blocked_servers))
-		]
-		known_servers = {
-			guild.id if isinstance(guild, Guild) else guild: guild.name
-			if isinstance(guild, Guild)
-			else (await lformat(loc, loc.l("transmit.autocomplete.unknown_server"), server_id=guild), True)
-			for guild in guilds
-		}
-
 		btn_id = uuid.uuid4()
 
 		disconnect = Button(style=ButtonStyle.DANGER, label="Disconnect", custom_id=str(btn_id))
@@ -298,54 +294,45 @@ class TransmissionCommands(Extension):
 				return False
 
 		task = asyncio.create_task(self.client.wait_for_component(components=disconnect, check=check_button))
-
-		disconnect_timer = 600
+		ended = asyncio.create_task(trans.ended.wait())
 
 		embed = await self.embed_manager("connected")
-		embed.description = f"[ Currently connected to **{other_server.name}**! ]"
-
-		while connection_alive(trans):
-			done, _ = await asyncio.wait({task}, timeout=1)
-
-			if not done:
-				if disconnect_timer % 10 == 0:
-					time = ftime(disconnect_timer)
-
-					embed.set_footer(text=f"Transmission will end in {time}.")
-
-					await msg.edit(embeds=embed, components=disconnect)
-
-				disconnect_timer -= 1
-
-				if disconnect_timer == 30:
-					await msg.reply("[ Transmission will end in 30 seconds. ]")
-
-				if disconnect_timer == 0:
-					embed = make_cancel_embed("timeout", server_name=other_server.name)
-
-					remove_connection(trans)
-					trans = None
-					await msg.edit(embeds=embed, components=[])
-					await msg.reply(embeds=embed)
-					return
-
-				continue  # * Important
-
-			remove_connection(trans)
+		# discord counts the timestamp down by itself, so the message doesn't need to be edited every few seconds
+		embed.description = (
+			f"[ Currently connected to **{other_server.name}**! ]\n-# Transmission will end <t:{int(trans.deadline or 0)}:R>."
+		)
+		await msg.edit(embeds=embed, components=disconnect)
+		warning = timer_wheel.schedule(
+			(trans.deadline or 0) - time.time() - 30, lambda: msg.reply("[ Transmission will end in 30 seconds. ]")
+		)
+
+		try:
+			await asyncio.wait({task, ended}, return_when=asyncio.FIRST_COMPLETED)
+		finally:
+			warning.cancel()
+			ended.cancel()
+
+		if not trans.ended.is_set():
+			await end_transmission(trans)
 			# what to show to server that did cancel ↓
 			await msg.edit(
 				embeds=make_cancel_embed("casual", other_server.name, task.result().ctx),
 				components=[],
 			)
 			await msg.reply(embeds=make_cancel_embed("manual", other_server.name, task.result().ctx))
+			return
+		task.cancel()
 
+		if trans.end_reason == "timeout":
+			embed = make_cancel_embed("timeout", server_name=other_server.name)
+			await msg.edit(embeds=embed, components=[])
+			await msg.reply(embeds=embed)
 			return
+
 		# what to show to server who didn't cancel ↓
 		await msg.edit(embeds=make_cancel_embed("casual", other_server.name), components=[])
 		await msg.reply(embeds=make_cancel_embed("server", other_server.name))
 
-		return remove_connection(trans)
-
 	class TransmitUser:
 		name: str
 		id: int
@@ -356,36 +343,24 @@ class TransmissionCommands(Extension):
 			self.id = u_id
 			self.image = image
 
-	async def check_anonymous(
-		self,
-		guild_id: int,
-		d_user: User | Member,
-		connection: Connection,
-		server_data: ServerData,
-	):
+	def check_anonymous(self, d_user: User | Member, connection: Connection):
 		user: TransmissionCommands.TransmitUser
 		if isinstance(d_user, Member):
 			d_user = d_user.user
-		if server_data.transmissions.anonymous:
-			i = 0
-
-			selected_character = {}
-
-			for i, character in enumerate(connection.characters):
+		if connection.anonymous:
+			for character in connection.characters:
 				if character["id"] == 0 or character["id"] == d_user.id:
-					user = TransmissionCommands.TransmitUser(
-						character["Name"],
-						d_user.id,
-						f"https://cdn.discordapp.com/emojis/{character['Image']}.png",
-					)
-
-					connection.characters[i].update({"id": d_user.id})
-
-					selected_character = character
-
-					return user
+					character["id"] = d_user.id
+					break
+			else:
+				# every character is taken, people past that share them
+				character = connection.characters[d_user.id % len(connection.characters)]
 
-			user = TransmissionCommands.TransmitUser(selected_character["name"], d_user.id, selected_character["image"])
+			user = TransmissionCommands.TransmitUser(
+				character["Name"],
+				d_user.id,
+				f"https://cdn.discordapp.com/emojis/{character['Image']}.png",
+			)
 		else:
 			user = TransmissionCommands.TransmitUser(d_user.username, d_user.id, d_user.display_avatar.url)
 
@@ -405,38 +380,25 @@ class TransmissionCommands(Extension):
 
 		if guild is None:
 			return
-		t = get_transmission(guild.id)
-		if not t:
+		t = get_channel_transmission(channel.id)
+		if not t or t.peer is None:
 			return
 
-		if not connection_alive(t) or t.connection_b is None:
-			return
+		# already done when the transmission connected, unless a message comes in before that finished
+		await t.connection.load(self.client)
+
+		user = self.check_anonymous(message.author, t.connection)
+		embed = await self.message_manager(message, user, t.connection.allow_images)
+		# the peer's channel may belong to another bot process, that one sends it
+		await relay_message(t, embed.to_dict())
 
-		server_data: ServerData = await ServerData(_id=guild.id).fetch()
-
-		first_server = t.connection_a
-		second_server = t.connection_b
-
-		can_pass = False
-		other_connection: TYPE_ALL_CHANNEL | None
-		allow_images = True
-		if first_server.channel_id == channel.id:
-			can_pass = True
-			user = await self.check_anonymous(guild.id, message.author, first_server, server_data)
-			other_connection = await self.client.fetch_channel(second_server.channel_id)
-			allow_images = server_data.transmissions.allow_images
-
-		if second_server.channel_id == channel.id:
-			can_pass = True
-			user = await self.check_anonymous(guild.id, message.author, second_server, server_data)
-			other_connection = await self.client.fetch_channel(first_server.channel_id)
-			allow_images = server_data.transmissions.allow_images
-
-		if can_pass:
-			embed = await self.message_manager(message, user, allow_images)
-			if isinstance(other_connection, TYPE_MESSAGEABLE_CHANNEL):
-				await other_connection.send(embeds=embed)
+	async def deliver(self, trans: Transmission, event: dict):
+		"""Sends a message relayed from the peer into this side's channel."""
+		await trans.connection.load(self.client)
+		channel: TYPE_ALL_CHANNEL | None = trans.connection.channel
+		if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
 			raise TypeError("tried to send message in a channel where i can't send messages :mumawomp:")
+		await channel.send(embeds=Embed.from_dict(event["embed"]))
 
 	async def message_manager(self, message: Message, user: TransmitUser, allow_images: bool):
 		final_text = message.content
@@ -484,7 +446,7 @@ class TransmissionCommands(Extension):
 
 
 def make_cancel_embed(
-	cancel_reason: Literal["manual", "server", "timeout", "casual"],
+	cancel_reason: Literal["manual", "server", "timeout", "casual", "lost"],
 	server_name: str,
 	button_ctx=None,
 ):
@@ -510,8 +472,14 @@ def make_cancel_embed(
 			)
 		case "casual":
 			return Embed(description=f"-# the transmission with {server_name} has ended")
+		case "lost":
+			return Embed(
+				title="Transmission Cancelled.",
+				description="Stopped waiting for another server because of a connection problem, try again.",
+				color=Colors.RED,
+			)
 		case _:
-			raise ValueError("cancel_reason argument must be one of 'manual', 'server' or 'timeout'")
+			raise ValueError("cancel_reason argument must be one of 'manual', 'server', 'timeout', 'casual' or 'lost'")
 
 
 def setup(bot):
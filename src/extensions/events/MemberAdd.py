@@ -1,4 +1,3 @@
-import io
 import traceback as tb
 
 from interactions import (
@@ -12,7 +11,8 @@ from interactions.api.events import MemberAdd
 
 from utilities.database.schemas import ServerData
 from utilities.localization.localization import Localization, lformat
-from utilities.textbox.mediagen import Frame, render_frame
+from utilities.textbox.mediagen import Frame, render_textbox_frames
+from utilities.textbox.render_pool import RenderQueueFull
 
 
 class MemberAddEvent(Extension):
@@ -41,18 +41,15 @@ class MemberAddEvent(Extension):
 			server_name=guild.name,
 			member_count=guild.member_count,
 		)
-		buffer = io.BytesIO()
 		basic_facepic_command = "\\@"
 		if basic_facepic_command in message:
 			# default to this face unless they have some in their message already
 			message = f"\\@[OneShot/The World Machine/Pancakes]{message}"
 
-		images, durations = await render_frame(Frame(str(message)), False, loc)
-		images[0].save(buffer, format="PNG")
-		buffer.seek(0)
 		try:
 			if not event.guild.system_channel:
 				return
+			buffer = await render_textbox_frames([Frame(str(message))], filetype="PNG", loc=loc, owner=guild.id)
 			print(f"Trying to send welcome message for server {event.guild.id} in channel {event.guild.system_channel}")
 			if isinstance(target_channel, TYPE_MESSAGEABLE_CHANNEL):
 				return await target_channel.send(
@@ -61,6 +58,9 @@ class MemberAddEvent(Extension):
 					allowed_mentions=AllowedMentions.all() if server_data.welcome.ping else AllowedMentions.none(),
 				)
 			raise TypeError("tried to send message in a channel where i can't send messages :mumawomp:")
+		except RenderQueueFull:
+			# a lot of people joining at once, not a reason to turn the welcome message off
+			print(f"Skipped welcome message, too many are being rendered. {guild.id}")
 		except Exception as e:
 			print(f"Failed to send welcome message. {guild.id}/{target_channel.id}")
 			print(tb.format_exc(chain=True))
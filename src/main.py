@@ -17,7 +17,7 @@ import importlib
 import sys
 
 # Handled commands
-VALID_COMMANDS = ("bot", "textboxweb", "script")
+VALID_COMMANDS = ("bot", "textboxweb", "script", "broker", "cluster")
 
 run: str = "bot"
 if len(sys.argv) > 1:
@@ -25,6 +25,12 @@ if len(sys.argv) > 1:
 	if run not in VALID_COMMANDS:
 		raise ValueError(f"Invalid value passed to run script (available: {', '.join(VALID_COMMANDS)}, passed: {run})")
 
+if run in ("bot", "textboxweb"):
+	from utilities.textbox.render_pool import render_pool
+
+	# nothing has started a thread yet, it's only safe to fork the render workers until something does
+	render_pool.start()
+
 if run == "script":
 	if len(sys.argv) < 3:
 		print("Usage: python src/main.py script <script_name>")
@@ -50,15 +56,31 @@ if run == "textboxweb":
 	run_server()
 	exit(0)
 
+if run == "broker":
+	from utilities.transmission_backend import run_broker
+
+	asyncio.run(run_broker())
+	exit(0)
+
+if run == "cluster":
+	from utilities.cluster import run_cluster
+
+	run_cluster()
+	exit(0)
+
 from interactions import Client, Intents, IntervalTrigger, Task, listen, smart_cache
 from interactions.api.events import Startup
 
-from utilities.database.main import connect_to_db
+from utilities.cluster import runs_singletons, shard
+from utilities.database.main import connect_to_db, flush_pending_writes, items_updated, watch_changes
 from utilities.extensions import assign_events, load_commands
+from utilities.http_client import http_client
 from utilities.misc import set_status
+from utilities.nikogotchi_metadata import refresh_registry
 from utilities.profile.main import load_profile_assets
 from utilities.rolling import roll_avatar, roll_status
 from utilities.stats import system_monitor_task
+from utilities.transmission_connection_manager import close_backend
 
 intents = Intents.DEFAULT | Intents.MESSAGE_CONTENT | Intents.MESSAGES | Intents.GUILD_MEMBERS | Intents.GUILDS
 intents &= ~(
@@ -86,6 +108,8 @@ client = TWMClient(
 	message_cache=smart_cache.create_cache(150, 5),
 	member_cache=smart_cache.create_cache(150, 5000),
 	user_cache=smart_cache.create_cache(150, 5000),
+	shard_id=shard.shard_id,
+	total_shards=shard.total_shards,
 )
 client.started_at: datetime = datetime.now()  # type: ignore
 if do_rolling := get_config("bot.rolling.avatar", typecheck=bool) or get_config("bot.rolling.status"):
@@ -94,7 +118,8 @@ if do_rolling := get_config("bot.rolling.avatar", typecheck=bool) or get_config(
 	async def roll():
 		if get_config("bot.rolling.status", typecheck=bool) == True:
 			await roll_status(client)
-		if get_config("bot.rolling.avatar", typecheck=bool) == True:
+		# it's the same account on every shard
+		if get_config("bot.rolling.avatar", typecheck=bool) == True and runs_singletons():
 			await roll_avatar(client)
 
 
@@ -103,10 +128,13 @@ assign_events(client)
 
 @listen(Startup)
 async def on_startup(event: Startup):
-	asyncio.create_task(system_monitor_task())
+	asyncio.create_task(system_monitor_task(client))
 	asyncio.create_task(set_status(client, "[ Loading... ]"))
 	load_commands(client)
 	await connect_to_db()
+	if get_config("database.change-streams", typecheck=bool, ignore_None=True):
+		asyncio.create_task(watch_changes("ItemData", items_updated))
+		asyncio.create_task(watch_changes("NikogotchiFeatures", refresh_registry))
 	asyncio.create_task(load_profile_assets())
 	await client.wait_until_ready()
 	await client._cache_interactions()
@@ -120,5 +148,18 @@ async def on_startup(event: Startup):
 	await ReadyEvent.followup(startupped)
 
 
+async def run():
+	try:
+		await client.astart(get_token())
+	finally:
+		# write-behind counters would be lost otherwise
+		await flush_pending_writes()
+		await http_client.close()
+		await close_backend()
+
+
 logger.log(INFO, colored("Finalizing... ─ ─ ─ ─ ─ ─ ─ ─ 2/3\n\n", "light_yellow"))
-client.start(get_token())
\ No newline at end of file
+try:
+	asyncio.run(run())
+except KeyboardInterrupt:
+	pass
\ No newline at end of file
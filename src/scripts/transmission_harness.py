@@ -0,0 +1,127 @@
+"""
+Runs a transmission between two bot processes through a broker, without Discord: one server waits, the other
+process skips it while it's blocked and then connects to it, they relay a message each way and one disconnects.
+
+python src/main.py script transmission_harness
+"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+from utilities.transmission_backend import Broker, BrokerBackend
+
+TIMEOUT = 10  # seconds to wait for each step
+
+
+def report(step: str, **data):
+	print("harness", json.dumps({"step": step, **data}), flush=True)
+
+
+async def bot(role: str, port: int):
+	import utilities.transmission_connection_manager as manager
+
+	manager.set_backend(BrokerBackend("127.0.0.1", port))
+	relayed: asyncio.Queue = asyncio.Queue()
+
+	async def relay(trans, event):
+		await relayed.put(event["embed"])
+
+	manager.set_relay(relay)
+
+	if role == "waiting":
+		trans = await manager.start_transmission(1, 11)
+		report("waiting", connected=trans.connected.is_set())
+		await asyncio.wait_for(trans.connected.wait(), TIMEOUT)
+		report("connected", peer=trans.peer and trans.peer.server_id)
+		report("received", embed=await asyncio.wait_for(relayed.get(), TIMEOUT))
+		await manager.relay_message(trans, {"description": "hi from the waiting server"})
+		await asyncio.wait_for(trans.ended.wait(), TIMEOUT)
+		report("ended", reason=trans.end_reason)
+	else:
+		blocked = await manager.start_transmission(3, 33, block_list=["1"])
+		report("blocked", connected=blocked.connected.is_set())
+		await manager.end_transmission(blocked)
+		report("blocked ended", reason=blocked.end_reason)
+		trans = await manager.start_transmission(2, 22)
+		report("connected", connected=trans.connected.is_set(), peer=trans.peer and trans.peer.server_id)
+		await manager.relay_message(trans, {"description": "hi from the connecting server"})
+		report("received", embed=await asyncio.wait_for(relayed.get(), TIMEOUT))
+		await manager.end_transmission(trans)
+		report("ended", reason=trans.end_reason)
+	await manager.close_backend()
+
+
+async def spawn(role: str, port: int) -> asyncio.subprocess.Process:
+	src = str(Path(__file__).resolve().parents[1])
+	env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (src, os.environ.get("PYTHONPATH"))))}
+	return await asyncio.create_subprocess_exec(
+		sys.executable, "-m", "scripts.transmission_harness", role, str(port), stdout=asyncio.subprocess.PIPE, env=env
+	)
+
+
+async def next_step(process: asyncio.subprocess.Process) -> dict:
+	assert process.stdout is not None
+	while line := await asyncio.wait_for(process.stdout.readline(), TIMEOUT * 2):
+		if line.startswith(b"harness "):
+			return json.loads(line.removeprefix(b"harness "))
+	raise EOFError("the bot process exited")
+
+
+failures = 0
+
+
+def expect(name: str, got: dict, **expected):
+	global failures
+	ok = all(got.get(key) == value for key, value in expected.items())
+	failures += not ok
+	print(f"[ {'ok' if ok else 'FAIL'} ] {name}: {json.dumps(got)}")
+
+
+async def run():
+	broker = Broker()
+	server = await broker.start("127.0.0.1", 0)
+	port = server.sockets[0].getsockname()[1]
+	processes: list[asyncio.subprocess.Process] = []
+	try:
+		waiting = await spawn("waiting", port)
+		processes.append(waiting)
+		expect("waits when nobody else is", await next_step(waiting), step="waiting", connected=False)
+
+		connecting = await spawn("connecting", port)
+		processes.append(connecting)
+		expect("skips blocked servers", await next_step(connecting), step="blocked", connected=False)
+		expect("leaving the queue cancels", await next_step(connecting), step="blocked ended", reason="cancelled")
+		expect("connects to the waiting one", await next_step(connecting), step="connected", connected=True, peer=1)
+		expect("is told it's connected", await next_step(waiting), step="connected", peer=2)
+		expect(
+			"relays to the waiting one",
+			await next_step(waiting),
+			step="received",
+			embed={"description": "hi from the connecting server"},
+		)
+		expect(
+			"relays back", await next_step(connecting), step="received", embed={"description": "hi from the waiting server"}
+		)
+		expect("disconnects", await next_step(connecting), step="ended", reason="disconnected")
+		expect("is told it was disconnected", await next_step(waiting), step="ended", reason="disconnected")
+		for process in processes:
+			await asyncio.wait_for(process.wait(), TIMEOUT)
+		await asyncio.sleep(0.1)  # for the broker to notice they're gone
+		expect("nothing left on the broker", broker.stats(), waiting=0, channels=0, clients=0)
+	finally:
+		for process in processes:
+			if process.returncode is None:
+				process.kill()
+		server.close()
+
+	if failures:
+		print(f"{failures} step(s) failed")
+		sys.exit(1)
+	print("All steps passed.")
+
+
+if __name__ == "__main__":
+	asyncio.run(bot(sys.argv[1], int(sys.argv[2])))
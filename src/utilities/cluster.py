@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from logging import INFO, WARNING
+from typing import Any, NamedTuple
+
+from utilities.config import get_config
+from utilities.logging import createLogger
+
+CLUSTER_ENV = "TWM_CLUSTER"  # set by the supervisor for its workers, see `parse_shard`
+RESTART_RESET = 300  # seconds a worker has to stay up for its restart backoff to start over
+MAX_BACKOFF = 120  # seconds
+STOP_TIMEOUT = 30  # seconds workers get to flush and exit before they're killed
+STALE_REPORT = 60  # seconds after which a worker's last report isn't counted anymore
+
+logger = createLogger(__name__)
+
+
+class Shard(NamedTuple):
+	shard_id: int
+	total_shards: int
+	supervisor: tuple[str, int] | None  # where to report stats, None when not running in a cluster
+
+
+def parse_shard(value: str | None) -> Shard:
+	"""`<shard_id>/<total_shards>@<host>:<port>`, nothing means a single process with one shard."""
+	if not value:
+		return Shard(0, 1, None)
+	shards, _, address = value.partition("@")
+	shard_id, _, total_shards = shards.partition("/")
+	host, _, port = address.rpartition(":")
+	return Shard(int(shard_id), int(total_shards), (host, int(port)) if address else None)
+
+
+shard = parse_shard(os.environ.get(CLUSTER_ENV))
+
+
+def in_cluster() -> bool:
+	return shard.supervisor is not None
+
+
+def runs_singletons() -> bool:
+	"""Whether this process runs what there must be only one of, like avatar rolling. The first shard does."""
+	return shard.shard_id == 0
+
+
+def encode(message: dict) -> bytes:
+	return json.dumps(message).encode() + b"\n"
+
+
+class SupervisorLink:
+	"""A worker's connection to the supervisor: it sends its stats and gets the whole cluster's back."""
+
+	def __init__(self, host: str, port: int):
+		self.host = host
+		self.port = port
+		self._reader: asyncio.StreamReader | None = None
+		self._writer: asyncio.StreamWriter | None = None
+
+	async def report(self, stats: dict[str, Any]) -> dict[str, Any] | None:
+		"""The cluster's totals, or None when the supervisor can't be reached."""
+		try:
+			if self._reader is None or self._writer is None or self._writer.is_closing():
+				self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+			self._writer.write(encode({"shard_id": shard.shard_id, **stats}))
+			await self._writer.drain()
+			line = await self._reader.readline()
+			if not line:
+				raise ConnectionError("the supervisor closed the connection")
+			return json.loads(line)
+		except (OSError, ValueError):
+			if self._writer is not None:
+				self._writer.close()
+			self._reader = self._writer = None
+			return None
+
+
+class Worker:
+	def __init__(self, shard_id: int):
+		self.shard_id = shard_id
+		self.process: asyncio.subprocess.Process | None = None
+		self.started = 0.0
+		self.restarts = 0  # in a row, without staying up for RESTART_RESET
+		self.report: dict[str, Any] = {}
+		self.reported = 0.0
+
+
+class Supervisor:
+	"""
+	Runs one bot process per shard and starts them again when they exit, with a backoff when they keep crashing.
+
+	Workers are started `identify_delay` seconds apart, Discord only lets one shard log in every 5 seconds. The
+	supervisor also hosts the transmission broker, and adds up the stats workers report from `system_monitor_task`.
+	"""
+
+	def __init__(self, total_shards: int, identify_delay: float = 5):
+		self.workers = [Worker(shard_id) for shard_id in range(total_shards)]
+		self.identify_delay = identify_delay
+		self.address: tuple[str, int] | None = None
+		self._stopping = asyncio.Event()
+		self._terminating: asyncio.Task | None = None
+
+	async def run(self):
+		# only the supervisor hosts it
+		from utilities.transmission_backend import Broker, broker_address
+
+		reports = await asyncio.start_server(self._reports, "127.0.0.1", 0)
+		self.address = reports.sockets[0].getsockname()[:2]
+		broker = await Broker().start(*broker_address())
+
+		loop = asyncio.get_running_loop()
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			try:
+				loop.add_signal_handler(sig, self.stop)
+			except NotImplementedError:  # windows
+				pass
+
+		logger.log(INFO, f"Starting {len(self.workers)} shards, {self.identify_delay}s apart")
+		watchers: list[asyncio.Task] = []
+		try:
+			for worker in self.workers:
+				if self._stopping.is_set():
+					break
+				watchers.append(asyncio.create_task(self._watch(worker)))
+				await self._sleep(self.identify_delay)
+			await asyncio.gather(*watchers)
+			if self._terminating is not None:
+				await self._terminating
+		finally:
+			reports.close()
+			broker.close()
+
+	async def _sleep(self, seconds: float):
+		"""Cut short when stopping."""
+		try:
+			await asyncio.wait_for(self._stopping.wait(), seconds)
+		except asyncio.TimeoutError:
+			pass
+
+	async def _spawn(self, worker: Worker):
+		assert self.address is not None
+		host, port = self.address
+		env = {**os.environ, CLUSTER_ENV: f"{worker.shard_id}/{len(self.workers)}@{host}:{port}"}
+		# in their own session, so ctrl+c in the terminal only reaches the supervisor, which then stops them once
+		worker.process = await asyncio.create_subprocess_exec(
+			sys.executable, sys.argv[0], "bot", env=env, start_new_session=True
+		)
+		worker.started = time.monotonic()
+
+	async def _watch(self, worker: Worker):
+		while not self._stopping.is_set():
+			await self._spawn(worker)
+			assert worker.process is not None
+			code = await worker.process.wait()
+			if self._stopping.is_set():
+				break
+			uptime = time.monotonic() - worker.started
+			worker.restarts = 0 if uptime > RESTART_RESET else worker.restarts + 1
+			delay = min(MAX_BACKOFF, self.identify_delay * 2**worker.restarts)
+			logger.log(
+				WARNING, f"Shard {worker.shard_id} exited with {code} after {uptime:.0f}s, restarting in {delay:.0f}s"
+			)
+			await self._sleep(delay)
+
+	def stop(self):
+		if self._stopping.is_set():
+			return
+		logger.log(INFO, "Stopping shards...")
+		self._stopping.set()
+		self._terminating = asyncio.create_task(self._terminate())
+
+	async def _terminate(self):
+		processes = [w.process for w in self.workers if w.process is not None and w.process.returncode is None]
+		for process in processes:
+			process.send_signal(signal.SIGINT)  # the bot flushes pending writes on the way out
+		try:
+			await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), STOP_TIMEOUT)
+		except asyncio.TimeoutError:
+			for process in processes:
+				if process.returncode is None:
+					process.kill()
+
+	async def _reports(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			while line := await reader.readline():
+				report = json.loads(line)
+				worker = self.workers[int(report["shard_id"])]
+				worker.report = report
+				worker.reported = time.monotonic()
+				writer.write(encode(self.totals()))
+				await writer.drain()
+		except (ConnectionError, ValueError, KeyError, IndexError):
+			pass
+		finally:
+			writer.close()
+
+	def totals(self) -> dict[str, Any]:
+		reports = [w.report for w in self.workers if w.report and time.monotonic() - w.reported < STALE_REPORT]
+		return {
+			"cpu": sum(report.get("cpu", 0) for report in reports),
+			"ram": sum(report.get("ram", 0) for report in reports),
+			"guilds": sum(report.get("guilds", 0) for report in reports),
+			"reporting": len(reports),
+			"shards": len(self.workers),
+			"restarts": sum(worker.restarts for worker in self.workers),
+		}
+
+
+def run_cluster():
+	delay = get_config("cluster.identify-delay", typecheck=int, ignore_None=True)
+	supervisor = Supervisor(
+		get_config("cluster.shards", typecheck=int, ignore_None=True) or os.cpu_count() or 1,
+		identify_delay=5 if delay is None else delay,
+	)
+	asyncio.run(supervisor.run())
@@ -1,9 +1,16 @@
+import asyncio
+import copy
+import time
+from collections import OrderedDict
 from dataclasses import dataclass, fields, is_dataclass
+from traceback import print_exc
 from typing import (
 	Any,
+	Callable,
 	Generic,
 	Iterable,
 	MutableMapping,
+	Sequence,
 	TypeVar,
 	get_origin,
 	get_type_hints,
@@ -13,8 +20,11 @@ from typing import (
 import yaml
 from interactions import Snowflake
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
 from pymongo.server_api import ServerApi
+from termcolor import colored
 
+from utilities.cluster import in_cluster
 from utilities.config import get_config
 
 if get_config("database.dns-fix", typecheck=bool, ignore_None=True):
@@ -25,6 +35,223 @@ if get_config("database.dns-fix", typecheck=bool, ignore_None=True):
 connection_uri = get_config("database.uri")
 
 
+class DocumentCache:
+	"""
+	Bounded LRU cache of raw documents for a single collection.
+
+	Entries older than `ttl` seconds are treated as missing and refetched. Documents are deep-copied on the way
+	in and out, so callers mutating a fetched collection never touch the cached copy.
+
+	Every write to a document bumps its version. A fetch takes `version()` before reading and hands it to `put`, which
+	drops the document if it was written to in the meantime, what was read may be older than that write.
+	"""
+
+	def __init__(self, max_size: int, ttl: float):
+		self.max_size = max_size
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+		self._version = 0
+		self._writes: OrderedDict[str, int] = OrderedDict()  # version of each document's last write, oldest first
+		self._forgotten = 0  # the newest version dropped from `_writes`, documents not in it count as written then
+
+	def get(self, _id: str | Snowflake) -> dict | None:
+		key = str(_id)
+		entry = self._entries.get(key)
+		if entry is None or time.monotonic() - entry[0] > self.ttl:
+			if entry is not None:
+				del self._entries[key]
+			self.misses += 1
+			return None
+		self._entries.move_to_end(key)
+		self.hits += 1
+		return copy.deepcopy(entry[1])
+
+	def version(self) -> int:
+		return self._version
+
+	def _written(self, key: str):
+		self._version += 1
+		self._writes[key] = self._version
+		self._writes.move_to_end(key)
+		while len(self._writes) > self.max_size:
+			_, self._forgotten = self._writes.popitem(last=False)
+
+	def put(self, _id: str | Snowflake, document: dict, version: int | None = None):
+		"""Caches a document that was just written, or one that was fetched when the cache was at `version`."""
+		key = str(_id)
+		if version is None:
+			self._written(key)
+		elif self._writes.get(key, self._forgotten) > version:
+			return
+		self._entries[key] = (time.monotonic(), copy.deepcopy(document))
+		self._entries.move_to_end(key)
+		while len(self._entries) > self.max_size:
+			self._entries.popitem(last=False)
+
+	def patch(self, _id: str | Snowflake, path: str | Sequence[str], value: Any):
+		"""Sets a (dotted) path inside the cached document, if it's cached."""
+		self._written(str(_id))
+		entry = self._entries.get(str(_id))
+		if entry is not None:
+			set_path(entry[1], path, copy.deepcopy(value))
+
+	def increment(self, _id: str | Snowflake, path: Sequence[str], by: int | float):
+		"""Adds `by` to a counter inside the cached document, if it's cached."""
+		self._written(str(_id))
+		entry = self._entries.get(str(_id))
+		if entry is None:
+			return
+		*parents, last = path
+		document = entry[1]
+		for part in parents:
+			document = document.setdefault(part, {})
+			if not isinstance(document, dict):
+				return
+		value = document.get(last, 0)
+		document[last] = (value if isinstance(value, (int, float)) else 0) + by
+
+	def invalidate(self, _id: str | Snowflake):
+		self._written(str(_id))
+		self._entries.pop(str(_id), None)
+
+	def clear(self):
+		self._entries.clear()
+		self._writes.clear()
+		self._forgotten = self._version  # fetches already running may have read something older
+
+	def stats(self) -> dict[str, int | float]:
+		total = self.hits + self.misses
+		return {
+			"size": len(self._entries),
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": round(self.hits / total, 3) if total else 0.0,
+		}
+
+
+# shards are separate processes and nothing tells one that another changed a document, so a cluster doesn't cache them
+cache_size: int = 0 if in_cluster() else get_config("database.cache.size", typecheck=int, ignore_None=True) or 2048
+cache_ttl: float = get_config("database.cache.ttl", typecheck=int, ignore_None=True) or 60
+# for the ItemData catalog and the nikogotchi registry, which shards only hear changed through change streams
+catalog_ttl: float = (
+	0
+	if in_cluster() and not get_config("database.change-streams", typecheck=bool, ignore_None=True)
+	else get_config("database.cache.catalog-ttl", typecheck=int, ignore_None=True) or 300
+)
+document_caches: dict[str, DocumentCache] = {}
+
+
+def get_document_cache(collection_name: str) -> DocumentCache:
+	if collection_name not in document_caches:
+		document_caches[collection_name] = DocumentCache(cache_size, cache_ttl)
+	return document_caches[collection_name]
+
+
+def cache_stats() -> dict[str, dict[str, int | float]]:
+	return {name: cache.stats() for name, cache in document_caches.items()}
+
+
+class CounterBuffer:
+	"""
+	Write-behind buffer for high-frequency counters.
+
+	Increments are summed per (collection, _id, field) and flushed as one `bulk_write` per collection, every
+	`interval` seconds or as soon as `max_ops` increments are pending.
+	"""
+
+	def __init__(self, interval: float, max_ops: int):
+		self.interval = interval
+		self.max_ops = max_ops
+		self.flushes = 0
+		self.writes = 0
+		self._pending: dict[str, dict[str, dict[tuple[str, ...], int | float]]] = {}
+		self._ops = 0
+		self._timer: asyncio.Task | None = None
+		self._flushing: set[asyncio.Task] = set()
+
+	def add(self, collection_name: str, _id: str | Snowflake, path: Sequence[str], by: int | float = 1):
+		counters = self._pending.setdefault(collection_name, {}).setdefault(str(_id), {})
+		key = tuple(path)
+		counters[key] = counters.get(key, 0) + by
+		self._ops += 1
+
+		if self._ops >= self.max_ops:
+			# the loop only keeps weak references to tasks
+			task = asyncio.create_task(self.flush())
+			self._flushing.add(task)
+			task.add_done_callback(self._flushing.discard)
+		elif self._timer is None:
+			self._timer = asyncio.create_task(self._flush_later())
+
+	async def _flush_later(self):
+		await asyncio.sleep(self.interval)
+		self._timer = None
+		await self.flush()
+
+	async def flush(self):
+		if self._timer is not None and self._timer is not asyncio.current_task():
+			self._timer.cancel()
+		self._timer = None
+
+		pending, self._pending, self._ops = self._pending, {}, 0
+		if not pending:
+			return
+
+		db = await get_database()
+		for collection_name, documents in pending.items():
+			requests = []
+			for _id, counters in documents.items():
+				increments = {}
+				stages = []
+				for path, by in counters.items():
+					if all(is_path_safe(part) for part in path):
+						increments[".".join(path)] = by
+					else:
+						stages.append(increment_stage(path, by))
+				if increments:
+					requests.append(UpdateOne({"_id": _id}, {"$inc": increments}, upsert=True))
+				if stages:
+					requests.append(UpdateOne({"_id": _id}, stages, upsert=True))
+			try:
+				await db.get_collection(collection_name).bulk_write(requests, ordered=False)
+				self.writes += len(requests)
+			except Exception:
+				print_exc()
+				# put them back so they go out with the next flush
+				for _id, counters in documents.items():
+					for path, by in counters.items():
+						self.add(collection_name, _id, path, by)
+		self.flushes += 1
+
+	def stats(self) -> dict[str, int]:
+		return {"pending": self._ops, "flushes": self.flushes, "writes": self.writes}
+
+
+def increment_stage(path: Sequence[str], by: int | float) -> dict:
+	"""
+	Pipeline stage incrementing a key that can't be used in a dotted path (contains dots, or starts with $), like the
+	ones in minis_shown. Only the last part of `path` may be such a key. Needs MongoDB 5.0+ for $getField/$setField.
+	"""
+	*parents, last = path
+	parent_path = ".".join(parents)
+	parent = {"$ifNull": [f"${parent_path}", {}]}
+	value = {"$add": [{"$ifNull": [{"$getField": {"field": {"$literal": last}, "input": parent}}, 0]}, by]}
+	return {"$set": {parent_path: {"$setField": {"field": {"$literal": last}, "input": parent, "value": value}}}}
+
+
+counter_buffer = CounterBuffer(
+	(get_config("database.write-behind.interval", typecheck=int, ignore_None=True) or 2000) / 1000,
+	get_config("database.write-behind.max-ops", typecheck=int, ignore_None=True) or 500,
+)
+
+
+async def flush_pending_writes():
+	await asyncio.gather(*counter_buffer._flushing)
+	await counter_buffer.flush()
+
+
 def init_things(self):
 	type_hints = get_type_hints(self.__class__)
 	if is_dataclass(self):
@@ -68,40 +295,86 @@ class Collection:
 	_id: str | Snowflake
 
 	async def update(self, **kwargs):
-		"""Update the current collection with the given kwargs."""
+		"""Update the current collection with the given kwargs, only the fields that changed are sent."""
 		updated_data = await update_in_database(self, **kwargs)
 		# The new overloads for to_dict will correctly infer a dict type here
 		for k, v in to_dict(updated_data).items():
 			setattr(self, k, v)
+		init_things(self)
+		self._synced = updated_data._synced
 		return init_things(updated_data)
 
 	async def fetch(self: TCollection) -> TCollection:
-		"""Fetch the current collection using id."""
+		"""Fetch the current collection using id, served from the document cache when possible."""
 		self._id = str(self._id)
+		cache = get_document_cache(self.__class__.__name__)
 
-		db = await get_database()
+		result = cache.get(self._id)
+		if result is None:
+			version = cache.version()
+			db = await get_database()
 
-		result = await db.get_collection(self.__class__.__name__).find_one({"_id": str(self._id)})
+			result = await db.get_collection(self.__class__.__name__).find_one({"_id": str(self._id)})
 
-		if result is None:
-			await new_entry(self)
-			return await self.fetch()
-		return self.__class__(**result)
+			if result is None:
+				await new_entry(self)
+				return await self.fetch()
+			cache.put(self._id, result, version)
+		fetched = self.__class__(**result)
+		fetched._synced = to_dict(result)
+		return fetched
 
 	def __post_init__(self):
+		# last state known to be in the database, used to diff updates against. None until fetched/written
+		self._synced: dict[str, Serializable] | None = None
 		init_things(self)
 
 	async def update_array(self, field: str, operator: str, value: Any):
 		db = await get_database()
+		cache = get_document_cache(self.__class__.__name__)
+		# array operators can't be replayed on the cached copy reliably, so the next fetch goes to the database.
+		# again after the write too, a fetch during it would have cached the old document
+		cache.invalidate(self._id)
 		await db.get_collection(self.__class__.__name__).update_one({"_id": str(self._id)}, {operator: {field: value}})
+		cache.invalidate(self._id)
 
-	async def increment_key(self, key: str, by: int | float = 1):
-		value = getattr(self, key, 0)
+	async def increment(
+		self,
+		key: str,
+		by: int | float = 1,
+		minimum: int | float | None = None,
+		maximum: int | float | None = None,
+	) -> int | float:
+		"""
+		Atomically increments `key` (can be a dotted path) in the database and returns the updated value.
+
+		The result is clamped to `minimum`/`maximum` server-side, so concurrent increments never lose updates.
+		"""
+		value = await increment_in_database(self, key, by, minimum, maximum)
+		set_local(self, key.split("."), value)
+		return value
+
+	def queue_increment(self, *path: str, by: int | float = 1) -> int | float:
+		"""
+		Increments the field at `path` locally and queues the `$inc` in the write-behind buffer.
+		Returns the updated value. Meant for counters that are bumped on every interaction.
+		"""
+		value = get_local(self, path, 0)
+		if not isinstance(value, (int, float)):
+			value = 0
+		value += by
+
+		set_local(self, path, value)
+		if self._synced is not None:
+			set_path(self._synced, path, value)
+		# the cached copy gets the increment rather than this instance's value, which may be stale
+		get_document_cache(self.__class__.__name__).increment(self._id, path, by)
+		counter_buffer.add(self.__class__.__name__, self._id, path, by)
+		return value
 
-		if isinstance(value, float):
-			by = float(by)
-		# could use self.key += by maybe, instead of returning a whole new objec (.update does that)
-		return await self.update(**{key: value + by})
+	async def increment_key(self, key: str, by: int | float = 1):
+		await self.increment(key, by)
+		return self
 
 
 # In main.py
@@ -151,7 +424,7 @@ class DBDict(MutableMapping):
 		return f"DB{repr(contents)}"
 
 	async def sync_to_db(self):
-		"""Helper method to sync the entire current state to the database."""
+		"""Helper method to sync the current state to the database, only keys that changed are sent."""
 		if self._parent is None or self._parent_field is None:
 			raise Exception("Parent not set for nested update.")
 
@@ -159,7 +432,7 @@ class DBDict(MutableMapping):
 		await self._parent.update(**update_fields)
 
 	async def update(self, *args, **kwargs):
-		"""Updates local attributes and then syncs the entire object to the database."""
+		"""Updates local attributes and then syncs the changed keys to the database."""
 		update_data = dict(*args, **kwargs)
 		for key, value in update_data.items():
 			self[key] = value
@@ -168,6 +441,17 @@ class DBDict(MutableMapping):
 
 	async def increment_key(self, key: str, by: int | float = 1):
 		value = self.get(key, 0)
+		if (
+			self._parent is not None
+			and self._parent_field is not None
+			and isinstance(value, (int, float))
+			and is_path_safe(key)
+		):
+			self[key] = await self._parent.increment(f"{self._parent_field}.{key}", by)
+			return
+
+		if not isinstance(value, (int, float)):
+			value = 0  # $inc fails on what isn't a number, it's set instead
 		if isinstance(value, float):
 			by = float(by)
 
@@ -294,7 +578,7 @@ class DBDynamicDict(MutableMapping, Generic[TKey, TValue]):
 		return f"DBD{repr(contents)}"
 
 	async def sync_to_db(self):
-		"""Helper method to sync the entire current state to the database."""
+		"""Helper method to sync the current state to the database, only keys that changed are sent."""
 		if self._parent is None or self._parent_field is None:
 			raise Exception("Parent not set for nested update.")
 
@@ -318,11 +602,29 @@ class DBDynamicDict(MutableMapping, Generic[TKey, TValue]):
 	async def increment_key(self, key: TKey, by: int | float = 1) -> None:
 		current_value = self.get(key, 0)
 
+		if (
+			self._parent is not None
+			and self._parent_field is not None
+			and isinstance(current_value, (int, float))
+			and is_path_safe(str(key))
+		):
+			self[key] = await self._parent.increment(f"{self._parent_field}.{key}", by)  # type: ignore
+			return
+
 		if not isinstance(current_value, (int, float)):
 			current_value = 0
 
 		await self.set_and_sync(key, (current_value + by))  # type: ignore
 
+	def queue_increment(self, key: TKey, by: int | float = 1) -> int | float:
+		"""Increments a key locally and queues the write, see `Collection.queue_increment`."""
+		if self._parent is None or self._parent_field is None:
+			raise Exception("Parent not set for nested update.")
+
+		value = self._parent.queue_increment(self._parent_field, str(key), by=by)
+		self[key] = value  # type: ignore
+		return value
+
 
 connection = None
 
@@ -350,20 +652,172 @@ async def get_database():
 
 async def new_entry(collection: Collection):
 	db = await get_database()
+	data = to_dict(collection)
 
 	await db.get_collection(collection.__class__.__name__).update_one(
-		{"_id": str(collection._id)}, {"$set": to_dict(collection)}, upsert=True
+		{"_id": str(collection._id)}, {"$set": data}, upsert=True
 	)
+	collection._synced = data
+	get_document_cache(collection.__class__.__name__).put(collection._id, {**data, "_id": str(collection._id)})
+
+
+def is_path_safe(key: str) -> bool:
+	"""Whether `key` can be used as a segment of a dotted update path."""
+	return key != "" and "." not in key and not key.startswith("$")
+
+
+def diff_fields(
+	old: dict[str, "Serializable"], new: dict[str, "Serializable"], prefix: str = ""
+) -> dict[str, "Serializable"]:
+	"""
+	Returns the `$set` document that turns `old` into `new`.
+
+	Nested dicts are descended into with dotted paths. A nested dict is set as a whole instead when keys were
+	removed from it, or when one of its keys can't be used in a path (e.g. minis_shown keys, which contain dots).
+	"""
+	changes: dict[str, Serializable] = {}
+	for key, value in new.items():
+		if key in old and old[key] == value:
+			continue
+		previous = old.get(key)
+		if (
+			isinstance(previous, dict)
+			and isinstance(value, dict)
+			and previous.keys() <= value.keys()
+			and all(is_path_safe(k) for k in value)
+		):
+			changes.update(diff_fields(previous, value, f"{prefix}{key}."))
+		else:
+			changes[prefix + key] = value
+	return changes
 
 
 async def update_in_database(collection: TCollection, **kwargs) -> TCollection:
 	db = await get_database()
 	existing_data = to_dict(collection)
-	updated_data = {**existing_data, **kwargs}  # pyright: ignore[reportGeneralTypeIssues]
-	await db.get_collection(collection.__class__.__name__).update_one(
-		{"_id": str(collection._id)}, {"$set": updated_data}, upsert=True
+	kwargs = {k: v for k, v in kwargs.items() if k == "_id" or not k.startswith("_")}
+	updated_data = {**existing_data, **to_dict(kwargs)}
+	updated_data["_id"] = str(collection._id)
+
+	if collection._synced is None:
+		# never read from the database, so there's nothing to diff against
+		changes = dict(updated_data)
+	else:
+		changes = diff_fields(collection._synced, updated_data)
+	changes.pop("_id", None)
+
+	if changes:
+		await db.get_collection(collection.__class__.__name__).update_one(
+			{"_id": str(collection._id)}, {"$set": changes}, upsert=True
+		)
+		# only what was sent, this instance may be stale in fields other copies changed
+		cache = get_document_cache(collection.__class__.__name__)
+		for path, value in changes.items():
+			cache.patch(collection._id, path, value)
+
+	updated = collection.__class__(**updated_data)
+	updated._synced = to_dict(updated_data)
+	return updated
+
+
+def set_path(document: dict, path: str | Sequence[str], value: Any):
+	*parents, last = path.split(".") if isinstance(path, str) else path
+	for part in parents:
+		document = document.setdefault(part, {})
+	document[last] = value
+
+
+def get_local(collection: Collection, path: Sequence[str], default: Any = None) -> Any:
+	target: Any = collection
+	for part in path:
+		if is_dataclass(target):
+			target = getattr(target, part, default)
+		elif isinstance(target, (MutableMapping, dict)):
+			target = target.get(part, default)
+		else:
+			return default
+	return target
+
+
+def set_local(collection: Collection, path: Sequence[str], value: Any):
+	*parents, last = path
+	target: Any = collection
+	for part in parents:
+		target = getattr(target, part) if is_dataclass(target) else target[part]
+	if is_dataclass(target):
+		setattr(target, last, value)
+	else:
+		target[last] = value
+
+
+async def increment_in_database(
+	collection: Collection,
+	path: str,
+	by: int | float = 1,
+	minimum: int | float | None = None,
+	maximum: int | float | None = None,
+) -> int | float:
+	db = await get_database()
+
+	if minimum is None and maximum is None:
+		update: dict | list = {"$inc": {path: by}}
+	else:
+		# $inc and $min/$max can't target the same field in one update, so clamping goes through a pipeline
+		value: Any = {"$add": [{"$ifNull": [f"${path}", 0]}, by]}
+		if minimum is not None:
+			value = {"$max": [value, minimum]}
+		if maximum is not None:
+			value = {"$min": [value, maximum]}
+		update = [{"$set": {path: value}}]
+
+	result = await db.get_collection(collection.__class__.__name__).find_one_and_update(
+		{"_id": str(collection._id)},
+		update,
+		projection={path: 1},
+		upsert=True,
+		return_document=ReturnDocument.AFTER,
 	)
-	return collection.__class__(**updated_data)
+	for part in path.split("."):
+		result = result[part]
+
+	if collection._synced is not None:
+		set_path(collection._synced, path, result)
+	get_document_cache(collection.__class__.__name__).patch(collection._id, path, result)
+	return result
+
+
+async def watch_changes(collection_name: str, callback: Callable[[], Any]):
+	"""
+	Calls `callback` whenever something in `collection_name` changes. Runs until the change stream fails, which
+	it does right away on deployments that aren't a replica set, caches relying on this still expire on their own.
+	"""
+	db = await get_database()
+	try:
+		async with db.get_collection(collection_name).watch() as stream:
+			async for _ in stream:
+				callback()
+	except Exception as e:
+		print(colored(f"─ Stopped watching {collection_name} for changes: {e}", "yellow"))
+
+
+items_subs: list[Callable[[], Any]] = []
+
+
+def on_items_update(callback: Callable[[], Any]):
+	items_subs.append(callback)
+
+	def unsubscribe():
+		if callback in items_subs:
+			items_subs.remove(callback)
+		else:
+			raise ValueError(f"Subscription was already removed before.")
+
+	return unsubscribe
+
+
+def items_updated():
+	for callback in items_subs:
+		callback()
 
 
 async def fetch_items():
@@ -378,6 +832,7 @@ async def update_shop(data: dict):
 	db = await get_database()
 
 	await db.get_collection("ItemData").update_one({"access": "ItemData"}, {"$set": {"shop": data}})
+	items_updated()
 
 
 Serializable = (
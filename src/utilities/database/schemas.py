@@ -54,15 +54,8 @@ class UserData(Collection):
 	times_shattered: int = 0
 	translation_language: str = "english"
 
-	async def manage_wool(self, amount: int):
-		wool = self.wool + amount
-
-		if wool <= 0:
-			wool = 0
-		elif wool >= 999_999_999_999_999_999:
-			wool = 999_999_999_999_999_999
-
-		return await self.update(wool=int(wool))
+	async def manage_wool(self, amount: int) -> int:
+		return int(await self.increment("wool", int(amount), minimum=0, maximum=999_999_999_999_999_999))
 
 
 @dataclass
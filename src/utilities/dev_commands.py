@@ -15,12 +15,21 @@ from termcolor import colored
 
 import utilities.database.main as main
 import utilities.database.schemas as schemas
+import utilities.transmission_connection_manager as transmissions
 from utilities.config import get_config, on_prod
 from utilities.emojis import emojis
+from utilities.fetch_cache import fetch_cache
+from utilities.fonts import atlas_stats
+from utilities.http_client import http_client
 from utilities.localization.formatting import fnum
+from utilities.localization.icu import parse_cache
 from utilities.message_decorations import Colors
 from utilities.misc import shell
+from utilities.nikogotchi_metadata import refresh_registry
 from utilities.shop.fetch_shop_data import get_shop_data
+from utilities.textbox.render_cache import render_cache
+from utilities.textbox.render_pool import render_pool
+from utilities.timer_wheel import timer_wheel
 
 ansi_escape_pattern = re.compile(r"\033\[[0-9;]*[A-Za-z]")
 
@@ -179,8 +188,26 @@ async def _execute_dev_command(message: Message):
 						return await message.reply(f"[ logs u {out.jump_url} ]")
 					out = await ReadyEvent.log(lambda channel: channel.send(content=text_to_log[1]))
 					return await message.reply(f"[ logged {out.jump_url} ]")
+				case "stats":
+					stats = {
+						"documents": main.cache_stats(),
+						"http": http_client.stats(),
+						"fetch_cache": fetch_cache.stats(),
+						"write_behind": main.counter_buffer.stats(),
+						"icu_parse": parse_cache.stats(),
+						"textbox_render": render_pool.stats(),
+						"textbox_cache": render_cache.stats(),
+						"glyph_atlas": atlas_stats(),
+						"timers": timer_wheel.stats(),
+						"transmissions": transmissions.stats(),
+					}
+					return await message.reply(
+						f"```yml\n{yaml.dump(stats, default_flow_style=False, Dumper=yaml.SafeDumper)}```"
+					)
 				case _:
-					return await message.reply("Available subcommands: `refresh` / `sync_commands` / `shell` / `log`")
+					return await message.reply(
+						"Available subcommands: `refresh` / `sync_commands` / `shell` / `log` / `stats`"
+					)
 		case "eval":
 			code = command_content.split(f"eval ")
 			referenced_message = message.get_referenced_message()
@@ -368,9 +395,15 @@ async def _execute_dev_command(message: Message):
 						return await message.reply(
 							f"`[ Successfully modified wool, updated value is now {collection.wool} ]`"
 						)
+					case "reload":
+						for cache in main.document_caches.values():
+							cache.clear()
+						main.items_updated()
+						refresh_registry()
+						return await message.reply("`[ Dropped cached documents, item catalog and nikogotchi registry ]`")
 					case _:
 						return await message.reply(
-							"Available subcommands: `set` / `view` / `view_all` / `wool`\nCollections:"
+							"Available subcommands: `set` / `view` / `view_all` / `wool` / `reload`\nCollections:"
 						)
 			except Exception as e:
 				tb.print_exc()
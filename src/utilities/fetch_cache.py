@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from traceback import print_exc
+from urllib.parse import urlparse
+
+import aiofiles
+
+from utilities.config import get_config
+from utilities.http_client import http_client
+
+
+@dataclass
+class CacheEntry:
+	data: bytes
+	fetched: float  # time.time() of when it was fetched or last revalidated
+	etag: str | None = None
+	last_modified: str | None = None  # the Last-Modified header for urls, st_mtime_ns for files
+
+
+class Namespace:
+	"""An LRU of `CacheEntry`s that stays under `max_bytes`, entries older than `ttl` seconds get revalidated."""
+
+	def __init__(self, name: str, max_bytes: int, ttl: float):
+		self.name = name
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.revalidated = 0
+		self.evictions = 0
+		self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+	def get(self, key: str) -> CacheEntry | None:
+		entry = self.entries.get(key)
+		if entry is not None:
+			self.entries.move_to_end(key)
+		return entry
+
+	def put(self, key: str, entry: CacheEntry) -> list[tuple[str, CacheEntry]]:
+		"""Stores `entry`, returning what got evicted to make room for it."""
+		old = self.entries.pop(key, None)
+		if old is not None:
+			self.bytes -= len(old.data)
+		if len(entry.data) > self.max_bytes:
+			return [(key, entry)]
+		self.entries[key] = entry
+		self.bytes += len(entry.data)
+		evicted = []
+		while self.bytes > self.max_bytes:
+			evicted_key, evicted_entry = self.entries.popitem(last=False)
+			self.bytes -= len(evicted_entry.data)
+			self.evictions += 1
+			evicted.append((evicted_key, evicted_entry))
+		return evicted
+
+	def stats(self) -> dict[str, int | float]:
+		total = self.hits + self.misses
+		return {
+			"entries": len(self.entries),
+			"bytes": self.bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"revalidated": self.revalidated,
+			"evictions": self.evictions,
+			"hit_rate": round(self.hits / total, 3) if total else 0.0,
+		}
+
+
+def namespace_of(location: str, is_file: bool) -> str:
+	if is_file:
+		return "files"
+	url = urlparse(location)
+	if url.hostname in ("cdn.discordapp.com", "media.discordapp.net"):
+		if url.path.startswith("/emojis/"):
+			return "emoji"
+		if "/avatars/" in url.path:
+			return "avatars"
+	return "other"
+
+
+class FetchCache:
+	"""
+	What `cached_get` fetched and read, split into namespaces (avatars, emoji, files, other) with their own budgets.
+
+	Stale entries are revalidated instead of fetched again: urls with If-None-Match/If-Modified-Since, files by their
+	modification time. With `disk_path` set, entries evicted from memory are spilled there instead of dropped.
+	"""
+
+	def __init__(self, namespaces: dict[str, Namespace], disk_path: str | None = None, disk_max_bytes: int = 0):
+		self.namespaces = namespaces
+		self.disk_path = Path(disk_path) if disk_path else None
+		self.disk_max_bytes = disk_max_bytes
+		self.disk_hits = 0
+		self._disk_bytes: int | None = None
+
+	def _disk_file(self, key: str) -> Path:
+		assert self.disk_path is not None
+		return self.disk_path / hashlib.sha256(key.encode()).hexdigest()
+
+	async def _spill(self, evicted: list[tuple[str, CacheEntry]]):
+		if self.disk_path is None:
+			return
+		try:
+			self.disk_path.mkdir(parents=True, exist_ok=True)
+			for key, entry in evicted:
+				if len(entry.data) > self.disk_max_bytes:
+					continue
+				file = self._disk_file(key)
+				meta = {**asdict(entry), "data": None}
+				async with aiofiles.open(file.with_suffix(".json"), "w") as f:
+					await f.write(json.dumps(meta))
+				async with aiofiles.open(file, "wb") as f:
+					await f.write(entry.data)
+				self._disk_bytes = (self._disk_bytes or 0) + len(entry.data)
+			if self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes:
+				await asyncio.to_thread(self._trim_disk)
+		except OSError:
+			print_exc()
+
+	def _trim_disk(self):
+		assert self.disk_path is not None
+		files = sorted(
+			(file for file in self.disk_path.iterdir() if not file.suffix), key=lambda file: file.stat().st_mtime
+		)
+		total = sum(file.stat().st_size for file in files)
+		for file in files:
+			if total <= self.disk_max_bytes:
+				break
+			total -= file.stat().st_size
+			file.unlink(missing_ok=True)
+			file.with_suffix(".json").unlink(missing_ok=True)
+		self._disk_bytes = total
+
+	async def _unspill(self, key: str) -> CacheEntry | None:
+		if self.disk_path is None:
+			return None
+		file = self._disk_file(key)
+		try:
+			async with aiofiles.open(file.with_suffix(".json"), "r") as f:
+				meta = json.loads(await f.read())
+			async with aiofiles.open(file, "rb") as f:
+				meta["data"] = await f.read()
+		except (FileNotFoundError, ValueError):
+			return None
+		file.unlink(missing_ok=True)
+		file.with_suffix(".json").unlink(missing_ok=True)
+		if self._disk_bytes is not None:
+			self._disk_bytes -= len(meta["data"])
+		return CacheEntry(**meta)
+
+	async def _read_file(self, path: Path, entry: CacheEntry | None) -> CacheEntry:
+		mtime = str(os.stat(path).st_mtime_ns)
+		if entry is not None and entry.last_modified == mtime:
+			return entry
+		async with aiofiles.open(path, "rb") as f:
+			return CacheEntry(await f.read(), time.time(), last_modified=mtime)
+
+	async def _request(self, url: str, entry: CacheEntry | None) -> CacheEntry:
+		headers = {}
+		if entry is not None and entry.etag:
+			headers["If-None-Match"] = entry.etag
+		if entry is not None and entry.last_modified:
+			headers["If-Modified-Since"] = entry.last_modified
+		async with http_client.request("GET", url, headers=headers) as resp:
+			if resp.status == 304 and entry is not None:
+				return entry
+			resp.raise_for_status()
+			return CacheEntry(
+				await resp.read(),
+				time.time(),
+				etag=resp.headers.get("ETag"),
+				last_modified=resp.headers.get("Last-Modified"),
+			)
+
+	async def get(self, key: str, location: str | Path, is_file: bool, force: bool = False) -> bytes:
+		namespace = self.namespaces[namespace_of(str(location), is_file)]
+		entry = namespace.get(key)
+		if entry is None:
+			entry = await self._unspill(key)
+			if entry is not None:
+				self.disk_hits += 1
+		if entry is not None and not force and time.time() - entry.fetched < namespace.ttl:
+			namespace.hits += 1
+			if key not in namespace.entries:
+				await self._spill(namespace.put(key, entry))
+			return entry.data
+
+		fetched = await self._read_file(Path(location), entry) if is_file else await self._request(str(location), entry)
+		if entry is not None and fetched is entry:
+			namespace.revalidated += 1
+			entry.fetched = time.time()
+		else:
+			namespace.misses += 1
+		await self._spill(namespace.put(key, fetched))
+		return fetched.data
+
+	def clear(self):
+		for namespace in self.namespaces.values():
+			namespace.entries.clear()
+			namespace.bytes = 0
+
+	def stats(self) -> dict[str, dict[str, int | float] | int | None]:
+		return {
+			**{name: namespace.stats() for name, namespace in self.namespaces.items()},
+			"disk_hits": self.disk_hits,
+			"disk_bytes": self._disk_bytes,
+		}
+
+
+def make_namespace(name: str, size: int, ttl: float) -> Namespace:
+	return Namespace(
+		name,
+		max_bytes=get_config(f"http.cache.{name}.size", typecheck=int, ignore_None=True) or size,
+		ttl=get_config(f"http.cache.{name}.ttl", typecheck=int, ignore_None=True) or ttl,
+	)
+
+
+fetch_cache = FetchCache(
+	{
+		"avatars": make_namespace("avatars", 16 * 1024 * 1024, 10 * 60),
+		"emoji": make_namespace("emoji", 16 * 1024 * 1024, 24 * 60 * 60),
+		"files": make_namespace("files", 32 * 1024 * 1024, 60 * 60),
+		"other": make_namespace("other", 32 * 1024 * 1024, 60 * 60),
+	},
+	disk_path=get_config("http.cache.disk", ignore_None=True),
+	disk_max_bytes=get_config("http.cache.disk-size", typecheck=int, ignore_None=True) or 256 * 1024 * 1024,
+)
@@ -0,0 +1,124 @@
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+from PIL.ImageFont import FreeTypeFont
+
+fonts: dict[tuple[str, int], FreeTypeFont] = {}
+
+
+def get_font(path: str | Path, size: int) -> FreeTypeFont:
+	"""
+	Loads a font once per process (until `clear_fonts`), every later call with the same path and size gets the same
+	object.
+	"""
+	key = (str(path), size)
+	font = fonts.get(key)
+	if font is None:
+		font = fonts[key] = ImageFont.truetype(str(path), size)
+	return font
+
+
+@dataclass
+class Glyph:
+	box: tuple[int, int, int, int]  # where the mask goes, relative to the integer part of the position it's drawn at
+	mask: Image.Image | None  # None for glyphs that don't draw anything (spaces)
+
+
+class GlyphAtlas:
+	"""
+	LRU cache of rasterized text for one font, so drawing the same grapheme again is a lookup and a paste.
+
+	Masks are coverage only and colors are applied when pasting, so one entry serves every color. Pasting a color
+	through a mask blends exactly like `ImageDraw.text` does.
+	"""
+
+	def __init__(self, font: FreeTypeFont, max_size: int = 4096):
+		self.font = font
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self._glyphs: OrderedDict[tuple[str, float, float], Glyph] = OrderedDict()
+		self._lengths: OrderedDict[str, float] = OrderedDict()
+
+	def length(self, text: str) -> float:
+		"""Same as `ImageDraw.textlength`."""
+		length = self._lengths.get(text)
+		if length is None:
+			length = self._lengths[text] = self.font.getlength(text, "L")
+			if len(self._lengths) > self.max_size:
+				self._lengths.popitem(last=False)
+		return length
+
+	def _rasterize(self, text: str, start: tuple[float, float]) -> Glyph:
+		pad = int(self.font.size)
+		mask = Image.new("L", (int(math.ceil(self.length(text))) + pad * 2, pad * 4))
+		ImageDraw.Draw(mask).text((pad + start[0], pad + start[1]), text, font=self.font, fill=255)
+		box = mask.getbbox()
+		if box is None:
+			return Glyph((0, 0, 0, 0), None)
+		return Glyph((box[0] - pad, box[1] - pad, box[2] - pad, box[3] - pad), mask.crop(box))
+
+	def glyph(self, text: str, start: tuple[float, float] = (0.0, 0.0)) -> Glyph:
+		key = (text, start[0], start[1])
+		glyph = self._glyphs.get(key)
+		if glyph is not None:
+			self._glyphs.move_to_end(key)
+			self.hits += 1
+			return glyph
+		self.misses += 1
+		glyph = self._glyphs[key] = self._rasterize(text, start)
+		if len(self._glyphs) > self.max_size:
+			self._glyphs.popitem(last=False)
+		return glyph
+
+	def draw(self, image: Image.Image, xy: tuple[float, float], text: str, fill) -> tuple[int, int, int, int] | None:
+		"""
+		Draws a line of text like `ImageDraw.text` (default anchor, no stroke), returning the box it drew over.
+
+		Negative positions aren't cached, their fractional part renders differently, so they're drawn directly.
+		"""
+		if xy[0] < 0 or xy[1] < 0:
+			draw = ImageDraw.Draw(image)
+			draw.text(xy, text, font=self.font, fill=fill)
+			return draw.textbbox(xy, text, font=self.font)  # type: ignore
+
+		x, y = int(xy[0]), int(xy[1])
+		glyph = self.glyph(text, (xy[0] - x, xy[1] - y))
+		if glyph.mask is None:
+			return None
+		box = (glyph.box[0] + x, glyph.box[1] + y, glyph.box[2] + x, glyph.box[3] + y)
+		image.paste(fill, box, glyph.mask)
+		return box
+
+	def stats(self) -> dict[str, int | float]:
+		total = self.hits + self.misses
+		return {
+			"size": len(self._glyphs),
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": round(self.hits / total, 3) if total else 0.0,
+		}
+
+
+atlases: dict[tuple[str, int], GlyphAtlas] = {}
+
+
+def get_atlas(path: str | Path, size: int) -> GlyphAtlas:
+	key = (str(path), size)
+	atlas = atlases.get(key)
+	if atlas is None:
+		atlas = atlases[key] = GlyphAtlas(get_font(path, size))
+	return atlas
+
+
+def clear_fonts():
+	"""Drops every loaded font and its atlas, for when the files change."""
+	fonts.clear()
+	atlases.clear()
+
+
+def atlas_stats() -> dict[str, dict[str, int | float]]:
+	return {f"{Path(path).name}@{size}": atlas.stats() for (path, size), atlas in atlases.items()}
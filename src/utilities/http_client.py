@@ -0,0 +1,147 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Unpack
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp.client import _RequestOptions
+from aiohttp.typedefs import StrOrURL
+
+from utilities.config import get_config
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class HostStats:
+	def __init__(self):
+		self.requests = 0
+		self.errors = 0
+		self.retries = 0
+		self.total_ms = 0.0
+		self.max_ms = 0.0
+
+	def record(self, start: float):
+		elapsed = (time.perf_counter() - start) * 1000
+		self.requests += 1
+		self.total_ms += elapsed
+		self.max_ms = max(self.max_ms, elapsed)
+
+	def stats(self) -> dict[str, int | float]:
+		return {
+			"requests": self.requests,
+			"errors": self.errors,
+			"retries": self.retries,
+			"average_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+			"max_ms": round(self.max_ms, 1),
+		}
+
+
+class HTTPClient:
+	"""
+	One aiohttp session for every outbound request, so connections (and their TLS handshakes) get reused.
+
+	Failed requests are retried with exponential backoff on connection errors, timeouts and 429/5xx responses, only
+	for idempotent methods unless asked to. Latency is measured per host, up to when the response headers arrive.
+	"""
+
+	def __init__(
+		self,
+		limit: int = 100,
+		limit_per_host: int = 10,
+		dns_ttl: int = 300,
+		timeout: float = 30,
+		retries: int = 2,
+		backoff: float = 0.5,
+	):
+		self.limit = limit
+		self.limit_per_host = limit_per_host
+		self.dns_ttl = dns_ttl
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.hosts: dict[str, HostStats] = {}
+		self._session: aiohttp.ClientSession | None = None
+
+	@property
+	def session(self) -> aiohttp.ClientSession:
+		"""Made on first use, it has to be made inside the event loop."""
+		if self._session is None or self._session.closed:
+			self._session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(
+					limit=self.limit,
+					limit_per_host=self.limit_per_host,
+					ttl_dns_cache=self.dns_ttl,
+				),
+				timeout=aiohttp.ClientTimeout(total=self.timeout),
+			)
+		return self._session
+
+	def _backoff(self, attempt: int) -> float:
+		return min(self.backoff * 2**attempt, self.timeout)
+
+	def _delay(self, attempt: int, response: aiohttp.ClientResponse) -> float | None:
+		"""None when a 429 asks to wait longer than `timeout`, that's not worth retrying."""
+		if response.status == 429:
+			retry_after = response.headers.get("Retry-After", "")
+			if retry_after.replace(".", "", 1).isdigit():
+				return float(retry_after) if float(retry_after) <= self.timeout else None
+		return self._backoff(attempt)
+
+	@asynccontextmanager
+	async def request(
+		self, method: str, url: StrOrURL, retry: bool | None = None, **kwargs: Unpack[_RequestOptions]
+	) -> AsyncIterator[aiohttp.ClientResponse]:
+		"""Like `ClientSession.request`. The last response is given even if its status is one that gets retried."""
+		method = method.upper()
+		retries = self.retries if (method in IDEMPOTENT_METHODS if retry is None else retry) else 0
+		host = self.hosts.setdefault(urlparse(str(url)).hostname or "", HostStats())
+
+		attempt = 0
+		while True:
+			start = time.perf_counter()
+			try:
+				response = await self.session.request(method, url, **kwargs)
+			except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+				host.record(start)
+				host.errors += 1
+				if attempt >= retries:
+					raise
+				await asyncio.sleep(self._backoff(attempt))
+				host.retries += 1
+				attempt += 1
+				continue
+			host.record(start)
+
+			delay = self._delay(attempt, response) if response.status in RETRY_STATUSES and attempt < retries else None
+			if delay is not None:
+				response.release()
+				await asyncio.sleep(delay)
+				host.retries += 1
+				attempt += 1
+				continue
+
+			try:
+				yield response
+			finally:
+				response.release()
+			return
+
+	async def close(self):
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+	def stats(self) -> dict[str, dict[str, int | float]]:
+		return {host: stats.stats() for host, stats in self.hosts.items()}
+
+
+retries = get_config("http.retries", typecheck=int, ignore_None=True)
+http_client = HTTPClient(
+	limit=get_config("http.connections", typecheck=int, ignore_None=True) or 100,
+	limit_per_host=get_config("http.per-host", typecheck=int, ignore_None=True) or 10,
+	dns_ttl=get_config("http.dns-ttl", typecheck=int, ignore_None=True) or 300,
+	timeout=get_config("http.timeout", typecheck=int, ignore_None=True) or 30,
+	retries=2 if retries is None else retries,
+)
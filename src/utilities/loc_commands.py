@@ -1,11 +1,11 @@
 from itertools import chain
 
-import aiohttp
 import yaml
 from interactions import Message
 from termcolor import colored
 
 from utilities.config import get_config
+from utilities.http_client import http_client
 from utilities.localization.localization import local_override
 
 
@@ -47,12 +47,11 @@ async def execute_loc_command(message: Message):
 			):
 				return await message.reply("`[ You are not whitelisted for this locale ]`")
 			try:
-				async with aiohttp.ClientSession() as session:
-					async with session.get(attachment.url) as response:
-						if response.status != 200:
-							return await message.reply(f"`[ Failed to download the file: HTTP {response.status} ]`")
+				async with http_client.request("GET", attachment.url) as response:
+					if response.status != 200:
+						return await message.reply(f"`[ Failed to download the file: HTTP {response.status} ]`")
 
-						content = await response.text()
+					content = await response.text()
 
 				parsed_data = yaml.safe_load(content)
 				if parsed_data is None:
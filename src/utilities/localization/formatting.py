@@ -1,12 +1,61 @@
 import re
+from dataclasses import dataclass
 from datetime import timedelta
-from typing import Literal
+from functools import lru_cache
+from typing import Callable, Literal
 
 from babel import Locale
 from babel.dates import format_timedelta
+from babel.numbers import NumberPattern, parse_pattern
 from humanfriendly import format_timespan
 
 
+@dataclass
+class LocaleInfo:
+	"""Babel data for one locale code, resolved once instead of on every format call."""
+
+	locale: Locale
+	language: Locale
+	plural_form: Callable[[float | int], str]
+	ordinal_form: Callable[[float | int], str]
+	decimal_pattern: NumberPattern
+	integer_pattern: NumberPattern
+	percent_pattern: NumberPattern
+
+	def format_number(self, value: float | int, pattern: NumberPattern | str | None = None) -> str:
+		if pattern is None:
+			pattern = self.decimal_pattern
+		elif isinstance(pattern, str):
+			pattern = number_pattern(pattern)
+		return pattern.apply(value, self.locale)
+
+
+number_pattern = lru_cache(maxsize=256)(parse_pattern)
+
+locale_infos: dict[str, LocaleInfo] = {}
+
+
+def load_locale_info(code: str) -> LocaleInfo:
+	locale = Locale.parse(code, sep="-")
+	return LocaleInfo(
+		locale=locale,
+		language=Locale(locale.language),
+		plural_form=locale.plural_form,
+		ordinal_form=locale.ordinal_form,
+		decimal_pattern=number_pattern(locale.decimal_formats[None]),
+		integer_pattern=number_pattern("#,##0"),
+		percent_pattern=number_pattern(locale.percent_formats[None]),
+	)
+
+
+def get_locale_info(code: str) -> LocaleInfo:
+	"""Returns the babel data for a locale code like `en-US`, loading it the first time it's asked for."""
+	info = locale_infos.get(code)
+	if info is None:
+		info = locale_infos[code] = load_locale_info(code)
+	return info
+
+
 def amperjoin(items: list[str]):
 	items = list(map(str, items))
 	if len(items) == 0:
@@ -39,7 +88,7 @@ def ftime(
 	minimum_unit: Literal["year", "month", "week", "day", "hour", "minute", "second"] = "second",
 	**kwargs,
 ) -> str:
-	locale = Locale.parse(locale, sep="-").language
+	locale = get_locale_info(locale).language
 
 	if isinstance(duration, (int, float)):
 		duration = timedelta(seconds=duration)
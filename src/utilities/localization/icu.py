@@ -1,15 +1,18 @@
+import inspect
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
 from traceback import print_exc
-from typing import Any
+from typing import Any, Callable, Iterable
 
-from babel import Locale
-from babel.numbers import format_currency, format_decimal, format_percent
+from babel.numbers import format_currency
 from interactions import GLOBAL_SCOPE, BaseContext, Client, Snowflake, User
 from pyicumessageformat import Parser
 
-from utilities.config import get_token
+from utilities.config import get_config, get_token
 from utilities.emojis import emojis, flatten_emojis, on_emojis_update
-from utilities.localization.formatting import fnum
+from utilities.localization.formatting import fnum, get_locale_info
 from utilities.misc import decode_base64_padded
 
 emoji_dict = {}
@@ -24,10 +27,135 @@ def edicted(emojis):
 edicted(emojis)
 on_emojis_update(edicted)
 
-icu_parser = Parser({"allow_tags": False, "require_other": False})
+parser_options = {"allow_tags": False, "require_other": False}
+# pyicumessageformat doesn't promise a parser can be used by two threads at once, so each thread gets its own
+_parsers = threading.local()
 
 
-async def icu_select(
+def get_parser() -> Parser:
+	parser = getattr(_parsers, "parser", None)
+	if parser is None:
+		parser = _parsers.parser = Parser(parser_options)
+	return parser
+
+
+@dataclass
+class CompiledMessage:
+	tree: list
+	is_async: bool  # whether rendering can reach an I/O formatter, see `needs_async`
+
+
+def compile_message(message: str) -> CompiledMessage:
+	tree = get_parser().parse(message)
+	return CompiledMessage(tree, needs_async(tree))
+
+
+class ParseCache:
+	"""
+	LRU cache of compiled ICU messages, keyed by the message string.
+
+	Locked, because locales can be pre-parsed from a background thread while the bot is formatting.
+	"""
+
+	def __init__(self, max_size: int):
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self._trees: OrderedDict[str, CompiledMessage] = OrderedDict()
+		self._lock = threading.Lock()
+
+	def parse(self, message: str) -> CompiledMessage:
+		with self._lock:
+			compiled = self._trees.get(message)
+			if compiled is not None:
+				self._trees.move_to_end(message)
+				self.hits += 1
+				return compiled
+			self.misses += 1
+
+		compiled = compile_message(message)
+		self._store(message, compiled)
+		return compiled
+
+	def preparse(self, message: str):
+		with self._lock:
+			if message in self._trees:
+				return
+		try:
+			compiled = compile_message(message)
+		except Exception:
+			return  # broken strings get reported when they're actually rendered
+		self._store(message, compiled)
+
+	def _store(self, message: str, compiled: CompiledMessage):
+		with self._lock:
+			self._trees[message] = compiled
+			self._trees.move_to_end(message)
+			while len(self._trees) > self.max_size:
+				self._trees.popitem(last=False)
+
+	def forget(self, messages: Iterable[str]):
+		with self._lock:
+			for message in messages:
+				self._trees.pop(message, None)
+
+	def clear(self):
+		with self._lock:
+			self._trees.clear()
+
+	def stats(self) -> dict[str, int | float]:
+		total = self.hits + self.misses
+		return {
+			"size": len(self._trees),
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": round(self.hits / total, 3) if total else 0.0,
+		}
+
+
+parse_cache = ParseCache(get_config("localization.parse-cache-size", typecheck=int, ignore_None=True) or 20000)
+
+
+def collect_messages(data: Any) -> set[str]:
+	"""Every string in a (nested) locale."""
+	if isinstance(data, str):
+		return {data}
+	if isinstance(data, dict):
+		data = data.values()
+	elif not isinstance(data, (list, tuple)):
+		return set()
+	messages = set()
+	for value in data:
+		messages |= collect_messages(value)
+	return messages
+
+
+def preparse_messages(messages: Iterable[str], background: bool = False):
+	"""Fills the parse cache ahead of time so messages are never parsed while formatting."""
+
+	def work():
+		for message in messages:
+			parse_cache.preparse(message)
+
+	if background:
+		threading.Thread(target=work, daemon=True).start()
+	else:
+		work()
+
+
+@dataclass
+class Branch:
+	"""
+	Returned by formatters that pick a sub-message, which the evaluator then renders (sync or async).
+
+	`#` in the rendered branch is replaced by `number`, when given.
+	"""
+
+	message: Any
+	number: int | float | None = None
+
+
+def icu_select(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -40,26 +168,22 @@ async def icu_select(
 	if not isinstance(options, dict):
 		return value
 
-	result_branch = options.get(value, options.get("other", ""))
+	return Branch(options.get(value, options.get("other", "")))
 
-	return await render_icu(result_branch, variables, locale, client)
 
-
-async def icu_notempty(
+def icu_notempty(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
 	client: Any | None = None,
 	found_var: Any | None = None,
 ):
-	print(arguments)
-	input = arguments[2]
 	if found_var:
-		return await render_icu(input, variables, locale, client)
+		return Branch(arguments[2])
 	return ""
 
 
-async def icu_selectordinal(
+def icu_selectordinal(
 	arguments: tuple,
 	variables: dict,
 	locale: str,
@@ -81,20 +205,13 @@ async def icu_selectordinal(
 	if exact_key in options:
 		raw_result = options[exact_key]
 	else:
-		babel_locale = Locale.parse(locale, sep="-")
-		category = babel_locale.ordinal_form(value)
+		category = get_locale_info(locale).ordinal_form(value)
 		raw_result = options.get(category, options.get("other", ""))
 
-	rendered_result = await render_icu(raw_result, variables, locale, client)
-
-	if "#" in rendered_result:
-		formatted_num = fnum(int(value) if value.is_integer() else value, locale)
-		rendered_result = rendered_result.replace("#", formatted_num)
+	return Branch(raw_result, int(value) if value.is_integer() else value)
 
-	return rendered_result
 
-
-async def icu_plural(
+def icu_plural(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -114,21 +231,14 @@ async def icu_plural(
 	if exact_key in options:
 		raw_result = options[exact_key]
 	else:
-		babel_locale = Locale.parse(locale, sep="-")
-		category = babel_locale.plural_form(value)
+		category = get_locale_info(locale).plural_form(value)
 
 		raw_result = options.get(category, options.get("other", ""))
 
-	rendered_result = await render_icu(raw_result, variables, locale, client)
-
-	if "#" in rendered_result:
-		formatted_num = fnum(int(value) if value.is_integer() else value, locale)
-		rendered_result = rendered_result.replace("#", formatted_num)
-
-	return rendered_result
+	return Branch(raw_result, int(value) if value.is_integer() else value)
 
 
-async def icu_number(
+def icu_number(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -141,24 +251,22 @@ async def icu_number(
 		return str(found_var)
 
 	style = arguments[2]
-	babel_locale = Locale.parse(locale, sep="-")
+	info = get_locale_info(locale)
 
 	if style == "percent":
-		return format_percent(value, locale=babel_locale)
+		return info.format_number(value, info.percent_pattern)
 	elif style == "integer":
-		return format_decimal(value, format="#,##0", locale=babel_locale)
+		return info.format_number(value, info.integer_pattern)
 	elif style == "currency":
-		return format_decimal(value, locale=babel_locale)
+		return info.format_number(value)
 	elif style and isinstance(style, str) and style.startswith("::currency/"):
 		currency_code = style.split("/")[1]
-		return format_currency(value, currency_code, locale=babel_locale)
-	elif style and isinstance(style, str) and ("," in style or "." in style or "#" in style or "0" in style):
-		return format_decimal(value, format=style, locale=babel_locale)
+		return format_currency(value, currency_code, locale=info.locale)
 	else:
-		return format_decimal(value, format=style if style else None, locale=babel_locale)
+		return info.format_number(value, style if style else None)
 
 
-async def util_pretty_num(
+def util_pretty_num(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -176,7 +284,7 @@ async def util_pretty_num(
 		return input
 
 
-async def icu_emoji(
+def icu_emoji(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -253,7 +361,7 @@ async def util_user(
 	return user_data[prop]
 
 
-async def util_slash(
+def util_slash(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -270,7 +378,7 @@ async def util_slash(
 	return f"</{command_name}:{id}>"
 
 
-async def util_quote(
+def util_quote(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -296,7 +404,7 @@ DISCORD_TIMESTAMP_MAP = {
 }
 
 
-async def util_datetime(
+def util_datetime(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -326,7 +434,7 @@ async def util_datetime(
 	return f"<t:{seconds}:{discord_style}>"
 
 
-async def util_fallback(
+def util_fallback(
 	arguments: tuple[Any, Any, Any],
 	variables: dict[str, Any],
 	locale: str,
@@ -336,7 +444,7 @@ async def util_fallback(
 	return f"{{{arguments[0]}{'' if not arguments[1] else ' , ' + arguments[1]}{'' if not arguments[2] else ' , ' + str(arguments[2])}}}"
 
 
-icu_formatters = {
+icu_formatters: dict[str, Callable] = {
 	"emoji": icu_emoji,
 	"user": util_user,
 	"command": util_slash,
@@ -350,9 +458,42 @@ icu_formatters = {
 	"time": util_datetime,
 	"date": util_datetime,
 }
+async_formatters = {name for name, fn in icu_formatters.items() if inspect.iscoroutinefunction(fn)}
 
 
-async def parse_node(node: dict, variables, locale, client: Any | None = None):
+def needs_async(tree: list) -> bool:
+	"""
+	Whether rendering `tree` can reach an async (I/O) formatter, like `user`.
+
+	Types built from variables (`{a, {b}}`) can't be known ahead of time, so they count as async too.
+	"""
+	for node in tree:
+		if not isinstance(node, dict):
+			continue
+		variable = node.get("name")
+		format_type = node.get("type")
+		if isinstance(format_type, str) and "{" in format_type and "}" in format_type:
+			return True
+		if format_type in async_formatters and not (isinstance(variable, str) and variable.startswith(("/", ">"))):
+			return True
+
+		nested = [variable, node.get("format")]
+		options = node.get("options")
+		if isinstance(options, dict):
+			nested.extend(options.values())
+		for message in nested:
+			if isinstance(message, list) and needs_async(message):
+				return True
+			if isinstance(message, str) and "{" in message and "}" in message:
+				try:
+					if parse_cache.parse(message).is_async:
+						return True
+				except Exception:
+					return True
+	return False
+
+
+def prepare_node(node: dict) -> tuple[str, Any, Any] | Exception:
 	variable = node.get("name")
 	if variable is None:
 		return Exception("no variable passed")
@@ -371,12 +512,23 @@ async def parse_node(node: dict, variables, locale, client: Any | None = None):
 		variable = variable[1:]
 		format_type = "quote"
 
-	if isinstance(variable, str) and "{" in variable and "}" in variable:
-		variable = await render_icu(variable, variables, locale, client)
+	return variable, format_type, arg3
+
+
+def has_placeholders(value: Any) -> bool:
+	return isinstance(value, str) and "{" in value and "}" in value
 
-	if isinstance(format_type, str) and "{" in format_type and "}" in format_type:
-		format_type = await render_icu(format_type, variables, locale, client)
 
+def format_error(e: Exception) -> Exception:
+	print_exc()
+	errname = type(e).__name__
+	if errname == "Exception":
+		errname = "err"
+	return Exception(f"{errname}: {e}")
+
+
+def call_formatter(variable, format_type, arg3, variables, locale, client: Any | None = None):
+	"""Runs the formatter for a node, the result may be a coroutine (async formatters) or a `Branch`."""
 	if variable in variables:
 		found_var = variables[variable]
 		var_exists = True
@@ -392,7 +544,7 @@ async def parse_node(node: dict, variables, locale, client: Any | None = None):
 	if format_type in icu_formatters:
 		try:
 			fn = icu_formatters[format_type]
-			return await fn(
+			return fn(
 				(variable, format_type, arg3),
 				variables,
 				locale,
@@ -400,16 +552,12 @@ async def parse_node(node: dict, variables, locale, client: Any | None = None):
 				found_var=found_var,
 			)
 		except Exception as e:
-			print_exc()
-			errname = type(e).__name__
-			if errname == "Exception":
-				errname = "err"
-			return Exception(f"{errname}: {e}")
+			return format_error(e)
 	else:
 		if var_exists:
 			return found_var
 		else:
-			return await util_fallback(
+			return util_fallback(
 				(variable, format_type, arg3),
 				variables,
 				locale,
@@ -418,33 +566,110 @@ async def parse_node(node: dict, variables, locale, client: Any | None = None):
 			)
 
 
+def finish_branch(branch: Branch, rendered: str, locale: str) -> str:
+	if branch.number is not None and "#" in rendered:
+		rendered = rendered.replace("#", fnum(branch.number, locale))
+	return rendered
+
+
+async def parse_node(node: dict, variables, locale, client: Any | None = None):
+	prepared = prepare_node(node)
+	if isinstance(prepared, Exception):
+		return prepared
+	variable, format_type, arg3 = prepared
+
+	if has_placeholders(variable):
+		variable = await render_icu(variable, variables, locale, client)
+
+	if has_placeholders(format_type):
+		format_type = await render_icu(format_type, variables, locale, client)
+
+	result = call_formatter(variable, format_type, arg3, variables, locale, client)
+	try:
+		if inspect.isawaitable(result):
+			result = await result
+		if isinstance(result, Branch):
+			result = finish_branch(result, await render_icu(result.message, variables, locale, client), locale)
+	except Exception as e:
+		return format_error(e)
+	return result
+
+
+def parse_node_sync(node: dict, variables, locale, client: Any | None = None):
+	prepared = prepare_node(node)
+	if isinstance(prepared, Exception):
+		return prepared
+	variable, format_type, arg3 = prepared
+
+	if has_placeholders(variable):
+		variable = render_icu_sync(variable, variables, locale, client)
+
+	result = call_formatter(variable, format_type, arg3, variables, locale, client)
+	try:
+		if isinstance(result, Branch):
+			result = finish_branch(result, render_icu_sync(result.message, variables, locale, client), locale)
+	except Exception as e:
+		return format_error(e)
+	return result
+
+
+def join_nodes(output: list) -> str:
+	for i, parsed_node in enumerate(output):
+		if not isinstance(parsed_node, (str, int, float)):
+			output[i] = f"<! {str(parsed_node)} !>"
+		elif isinstance(parsed_node, (int, float)):
+			output[i] = str(parsed_node)
+	return "".join(output)
+
+
 async def evaluate_ast(tree, variables, locale, client: Client | None):
 	variables = {**variables, "_locale": locale}
 	output = []
 	for node in tree:
-		parsed_node = None
+		if isinstance(node, str):
+			output.append(node)
+		elif isinstance(node, dict):
+			output.append(await parse_node(node, variables, locale, client))
+		else:
+			output.append(Exception(f"node {node} has unexpected type for an icu tree"))
+
+	return join_nodes(output)
+
 
+def evaluate_ast_sync(tree, variables, locale, client: Client | None):
+	"""`evaluate_ast` for trees that don't need async formatters, without a coroutine per node."""
+	variables = {**variables, "_locale": locale}
+	output = []
+	for node in tree:
 		if isinstance(node, str):
-			parsed_node = node
+			output.append(node)
 		elif isinstance(node, dict):
-			parsed_node = await parse_node(node, variables, locale, client)
+			output.append(parse_node_sync(node, variables, locale, client))
 		else:
-			parsed_node = Exception(f"node {node} has unexpected type for an icu tree")
+			output.append(Exception(f"node {node} has unexpected type for an icu tree"))
 
-		if not isinstance(parsed_node, (str, int, float)):
-			parsed_node = f"<! {str(parsed_node)} !>"
-		elif isinstance(parsed_node, (int, float)):
-			parsed_node = str(parsed_node)
-		output.append(parsed_node)
+	return join_nodes(output)
 
-	return "".join(output)
+
+def render_icu_sync(message, variables, locale, client: Client | None = None) -> str:
+	"""Renders a message that's known to not need async formatters (see `needs_async`)."""
+	if isinstance(message, list):
+		return evaluate_ast_sync(message, variables, locale, client)
+
+	if not isinstance(message, str):
+		return str(message)
+	return evaluate_ast_sync(parse_cache.parse(message).tree, variables, locale, client)
 
 
 async def render_icu(message, variables, locale, client: Client | None = None):
 	if isinstance(message, list):
-		return await evaluate_ast(message, variables, locale, client)
+		if needs_async(message):
+			return await evaluate_ast(message, variables, locale, client)
+		return evaluate_ast_sync(message, variables, locale, client)
 
 	if not isinstance(message, str):
 		return str(message)
-	tree = icu_parser.parse(message)
-	return await evaluate_ast(tree, variables, locale, client)
+	compiled = parse_cache.parse(message)
+	if compiled.is_async:
+		return await evaluate_ast(compiled.tree, variables, locale, client)
+	return evaluate_ast_sync(compiled.tree, variables, locale, client)
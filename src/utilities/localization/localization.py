@@ -10,7 +10,8 @@ from termcolor import colored
 
 from extensions.events.Ready import ReadyEvent
 from utilities.config import debugging, get_config, on_prod
-from utilities.localization.icu import render_icu
+from utilities.localization.formatting import get_locale_info
+from utilities.localization.icu import collect_messages, parse_cache, preparse_messages, render_icu
 from utilities.misc import FrozenDict, format_type_hint, rabbit
 from utilities.source_watcher import FileModifiedEvent, all_of, filter_file_suffix, filter_path, subscribe
 
@@ -23,6 +24,7 @@ if on_prod:
 debug = debug if debug is not None else False
 
 fallback_locale: dict[str, dict]
+preparse: str | None = get_config("localization.preparse", ignore_None=True)
 
 
 def local_override(locale: str, data: dict):
@@ -68,11 +70,23 @@ def register_locale(locale: str, is_reload: bool = False) -> bool:
 				raise ValueError(f"Locale '{locale}' must be a directory, but a .yml file was found instead.")
 			raise ValueError(f"No translation data found in directory for '{locale}'")
 
+		old_messages = collect_messages(_locales[locale]) if locale in _locales else set()
 		_locales[locale] = FrozenDict(data)
 
 		if locale == get_config("localization.source-locale"):
 			fallback_locale = _locales[locale]
 
+		try:
+			get_locale_info(locale)
+		except Exception:
+			pass  # babel doesn't know this code, formatters that need it will report that when they run
+
+		if is_reload or preparse is not None:
+			new_messages = collect_messages(_locales[locale])
+			parse_cache.forget(old_messages - new_messages)
+			if preparse is not None:
+				preparse_messages(new_messages, background=preparse == "background")
+
 		if is_reload:
 			print(" ─ ─ ─ ")
 		return True
@@ -1,4 +1,3 @@
-import asyncio
 from typing import Literal
 
 from utilities.database.schemas import UserData
@@ -20,7 +19,7 @@ async def put_mini(
 		reacher = user_data.minis_shown.get(message, 0)
 		if show_up_amount != -1 and show_up_amount <= reacher:
 			return ""
-		asyncio.create_task(user_data.minis_shown.increment_key(database_key))
+		user_data.minis_shown.queue_increment(database_key)
 	name: str = await lformat(loc, loc.l(f"generic.minis.{type}", prefix_override="main"))
 	msg: str = await lformat(loc, loc.l(message))
 	return f"{pre}{'-# ' if markdown else ''}{name} {msg}"
@@ -17,7 +17,6 @@ from typing import (
 from urllib.parse import urlparse
 
 import aiofiles
-import aiohttp
 from aiohttp.client import _RequestOptions
 from aiohttp.typedefs import StrOrURL
 from interactions import (
@@ -91,11 +90,12 @@ async def fetch(
 	ignore_status: bool = False,
 	**kwargs: Unpack[_RequestOptions],
 ):
-	async with aiohttp.ClientSession() as session:
-		async with session.__getattribute__(method.lower())(url, **kwargs) as resp:
-			if not ignore_status:
-				resp.raise_for_status()
-			return await resp.__getattribute__(output)()
+	from utilities.http_client import http_client  # utilities.config imports this module, and http_client needs it
+
+	async with http_client.request(method, url, **kwargs) as resp:
+		if not ignore_status:
+			resp.raise_for_status()
+		return await resp.__getattribute__(output)()
 
 
 async def refresh_discord_cdn_link(url: list[str] | str, token: str):
@@ -121,10 +121,10 @@ async def read_file(path: Path | str):
 		return await f.read()
 
 
-cache: dict[str, bytes] = {}
-
-
 async def cached_get(location: str | Path, force: bool = False, raw: bool = False) -> io.BytesIO | bytes:
+	"""Fetches a url or reads a file through `fetch_cache`, `force` skips the cache."""
+	from utilities.fetch_cache import fetch_cache  # utilities.config imports this module, and fetch_cache needs it
+
 	loki = str(location)
 	is_file = Path(location).is_file()
 	if is_file:
@@ -133,10 +133,8 @@ async def cached_get(location: str | Path, force: bool = False, raw: bool = Fals
 	if location is str and (not location.startswith("https://") or not location.startswith("http://")):
 		raise ValueError("invalid url")
 
-	if force or loki not in cache:
-		cache[loki] = await read_file(Path(location)) if is_file else await fetch(loki)
-
-	return cache[loki] if raw else io.BytesIO(cache[loki])
+	data = await fetch_cache.get(loki, location, is_file, force=force)
+	return data if raw else io.BytesIO(data)
 
 
 def parse_path(raw_path: str) -> list[Union[str, int]]:
@@ -283,14 +281,16 @@ def shell(command: str) -> str:
 
 async def set_status(client: Client, text: str | list | None):
 	from utilities.localization.localization import lformat, source_loc
+	from utilities.stats import get_stats
 
 	if text is not None:
+		guilds = get_stats().guilds  # the whole cluster's
 		status = str(
 			await lformat(
 				source_loc,
 				input=text,
-				shard_count=len(client.shards) if hasattr(client, "shards") else 1,  # type: ignore
-				guild_count=len(client.guilds),
+				shard_count=client.total_shards,
+				guild_count=len(client.guilds) if guilds is None else guilds,
 			)
 		)
 	await client.change_presence(activity=Activity(name="meow", type=ActivityType.CUSTOM, state=status))
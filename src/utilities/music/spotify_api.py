@@ -1,6 +1,8 @@
+import asyncio
+import time
 from dataclasses import dataclass
 
-import aiohttp
+from utilities.http_client import http_client
 
 
 @dataclass
@@ -31,120 +33,115 @@ def create_track(data: dict):
 		pass
 
 
+TOKEN_MARGIN = 60  # seconds before a token expires that it gets refreshed
+TRACK_BATCH = 50  # most ids /v1/tracks takes at once
+
+
+def spotify_id(url: str, kind: str) -> str:
+	url = url.replace(f"https://open.spotify.com/{kind}/", "")
+	url = url.replace(f"http://open.spotify.com/{kind}/", "")
+	return url.split("?")[0].strip("/")
+
+
 class Spotify:
-	def __init__(self, client_id, secret):
+	def __init__(self, client_id, secret, page_concurrency: int = 4):
 		self.client_id = client_id
 		self.secret = secret
+		self.pages = asyncio.Semaphore(page_concurrency)
+		self._token: str | None = None
+		self._token_expires = 0.0
+		self._token_lock = asyncio.Lock()
 
 	async def get_access_token(self):
-		auth_url = "https://accounts.spotify.com/api/token"
-
-		# Your client_id and secret
-		client_id = self.client_id
-		secret = self.secret
-
-		# Define the headers for the token request
-		headers = {
-			"Content-Type": "application/x-www-form-urlencoded",
-		}
-
-		# Define the data for the token request
-		data = {
-			"grant_type": "client_credentials",
-			"client_id": client_id,
-			"client_secret": secret,
-		}
-
-		async with aiohttp.ClientSession() as session:
-			async with session.post(auth_url, headers=headers, data=data) as resp:
+		"""Client credentials token, reused until it's about to expire."""
+		if self._token and time.monotonic() < self._token_expires - TOKEN_MARGIN:
+			return self._token
+		async with self._token_lock:
+			if self._token and time.monotonic() < self._token_expires - TOKEN_MARGIN:
+				return self._token
+
+			auth_url = "https://accounts.spotify.com/api/token"
+
+			# Define the headers for the token request
+			headers = {
+				"Content-Type": "application/x-www-form-urlencoded",
+			}
+
+			# Define the data for the token request
+			data = {
+				"grant_type": "client_credentials",
+				"client_id": self.client_id,
+				"client_secret": self.secret,
+			}
+
+			async with http_client.request("POST", auth_url, retry=True, headers=headers, data=data) as resp:
 				response_data = await resp.json()
-				# The access token is in response_data['access_token']
-				return response_data["access_token"]
+				self._token = response_data["access_token"]
+				self._token_expires = time.monotonic() + response_data.get("expires_in", 3600)
+				return self._token
 
-	async def get_track(self, query):
+	async def get_json(self, url: str, retry_unauthorized: bool = True):
 		access_token = await self.get_access_token()
-		headers = {"Authorization": f"Bearer {access_token}"}
+		async with self.pages:
+			async with http_client.request("GET", url, headers={"Authorization": f"Bearer {access_token}"}) as resp:
+				if resp.status != 401 or not retry_unauthorized:
+					return await resp.json()
+		# the token stopped working before it expired, drop it (unless that already happened) and retry with a new one
+		if self._token == access_token:
+			self._token = None
+		return await self.get_json(url, retry_unauthorized=False)
 
+	async def get_track(self, query):
 		if "open.spotify.com/track/" in query:
-			query = query.replace("https://open.spotify.com/track/", "")
-			query = query.replace("http://open.spotify.com/track/", "")
-
-			async with aiohttp.ClientSession() as session:
-				async with session.get(f"https://api.spotify.com/v1/tracks/{query}/", headers=headers) as resp:
-					data = await resp.json()
-					return create_track(data)
+			data = await self.get_json(f"https://api.spotify.com/v1/tracks/{spotify_id(query, 'track')}/")
+			return create_track(data)
 		else:
-			async with aiohttp.ClientSession() as session:
-				async with session.get(
-					f"https://api.spotify.com/v1/search?q={query}&type=track&limit=1",
-					headers=headers,
-				) as resp:
-					data = await resp.json()
-					track = data["tracks"]["items"][0]
-					return create_track(track)
+			data = await self.get_json(f"https://api.spotify.com/v1/search?q={query}&type=track&limit=1")
+			track = data["tracks"]["items"][0]
+			return create_track(track)
+
+	async def get_tracks(self, ids: list[str]) -> list[SpotifyTrack | None]:
+		"""Full tracks for `ids` in the same order, fetched `TRACK_BATCH` at a time."""
+		batches = await asyncio.gather(
+			*(
+				self.get_json(f"https://api.spotify.com/v1/tracks?ids={','.join(ids[i : i + TRACK_BATCH])}")
+				for i in range(0, len(ids), TRACK_BATCH)
+			)
+		)
+		return [create_track(track) if track else None for batch in batches for track in batch.get("tracks", [])]
+
+	async def get_pages(self, first_page: dict, url: str) -> list[dict]:
+		"""Every item of a paged list, the pages after `first_page` are fetched at the same time."""
+		limit = first_page["limit"] or len(first_page["items"]) or 1
+		pages = await asyncio.gather(
+			*(
+				self.get_json(f"{url}?offset={offset}&limit={limit}")
+				for offset in range(first_page["offset"] + limit, first_page["total"], limit)
+			)
+		)
+		return first_page["items"] + [item for page in pages for item in page.get("items", [])]
 
 	async def get_playlist(self, url):
-		access_token = await self.get_access_token()
-		headers = {"Authorization": f"Bearer {access_token}"}
-
 		if "open.spotify.com/playlist/" in url:
-			url = url.replace("https://open.spotify.com/playlist/", "")
-			url = url.replace("http://open.spotify.com/playlist/", "")
-			async with aiohttp.ClientSession() as session:
-				url = f"https://api.spotify.com/v1/playlists/{url}"
-				tracks = []
-
-				while True:
-					async with session.get(url, headers=headers) as resp:
-						try:
-							data = await resp.json()
-						except:
-							return None
-
-						try:
-							get_items = data["tracks"]
-						except:
-							get_items = data
-
-						for item in get_items["items"]:
-							track = create_track(item["track"])
-
-							tracks.append(track)
-
-						url = get_items["next"]
-
-						if url is None:
-							break
-
-				return tracks
+			playlist_id = spotify_id(url, "playlist")
+			try:
+				data = await self.get_json(f"https://api.spotify.com/v1/playlists/{playlist_id}")
+				items = await self.get_pages(
+					data["tracks"], f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
+				)
+			except:
+				return None
+			return [create_track(item["track"]) for item in items]
 		else:
-			async with aiohttp.ClientSession() as session:
-				url = url.replace("https://open.spotify.com/album/", "")
-				url = url.replace("http://open.spotify.com/album/", "")
-				async with session.get(f"https://api.spotify.com/v1/albums/{url}", headers=headers) as resp:
-					data = await resp.json()
-
-					tracks = []
-
-					for item in data["tracks"]["items"]:
-						track = await self.get_track(f"https://open.spotify.com/track/{item['id']}")
-
-						tracks.append(track)
-
-					return tracks
+			album_id = spotify_id(url, "album")
+			data = await self.get_json(f"https://api.spotify.com/v1/albums/{album_id}")
+			# album tracks don't have isrcs, so they're fetched again in batches
+			items = await self.get_pages(data["tracks"], f"https://api.spotify.com/v1/albums/{album_id}/tracks")
+			# local and unavailable tracks have no id, and one "None" in the ids makes spotify reject the whole batch
+			return await self.get_tracks([item["id"] for item in items if item.get("id")])
 
 	async def search(self, query, limit=25, type="track"):
-		access_token = await self.get_access_token()
-		headers = {"Authorization": f"Bearer {access_token}"}
-
-		async with aiohttp.ClientSession() as session:
-			async with session.get(
-				f"https://api.spotify.com/v1/search?q={query}&type={type}&limit={limit}",
-				headers=headers,
-			) as resp:
-				try:
-					data = await resp.json()
-				except:
-					return "error"
-
-				return data
+		try:
+			return await self.get_json(f"https://api.spotify.com/v1/search?q={query}&type={type}&limit={limit}")
+		except:
+			return "error"
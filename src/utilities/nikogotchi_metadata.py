@@ -1,8 +1,14 @@
+import asyncio
 import random
+import time
 from dataclasses import dataclass
 from enum import Enum
+from logging import WARNING
 
-from utilities.database.main import get_database
+from utilities.database.main import catalog_ttl, get_database
+from utilities.logging import createLogger
+
+logger = createLogger(__name__)
 
 
 class Rarity(Enum):
@@ -25,37 +31,67 @@ def convert_to_class(data: dict, nid: str):
 	return NikogotchiMetadata(nid, Rarity(data["rarity"]), data["image"])
 
 
-async def fetch_nikogotchi_metadata(nid: str) -> NikogotchiMetadata | None:
-	db = await get_database()
+@dataclass
+class NikogotchiRegistry:
+	"""Every nikogotchi from the NikogotchiFeatures document, by nid and bucketed by rarity."""
 
-	result = await db.get_collection("NikogotchiFeatures").find_one(
-		{"key": "NikogotchiFeatures"}, {"_id": 0, "nikogotchi": 1}
-	)
+	by_nid: dict[str, NikogotchiMetadata]
+	by_rarity: dict[Rarity, list[NikogotchiMetadata]]
+	loaded_at: float
 
-	# Cast the result to the expected structure
-	nikogotchi_data: dict[str, NikogotchiMetadata] = result["nikogotchi"] if result else {}
-	nikogotchi_info = nikogotchi_data.get(nid)
-	if nikogotchi_info == None or type(nikogotchi_info) is not dict:
-		return None
-	return convert_to_class(nikogotchi_info, nid)
 
+registry: NikogotchiRegistry | None = None
+registry_lock = asyncio.Lock()
 
-async def pick_random_nikogotchi(rarity: int):
+
+def refresh_registry():
+	"""Drops the loaded registry, the next lookup loads it again."""
+	global registry
+	registry = None
+
+
+async def load_registry() -> NikogotchiRegistry:
 	db = await get_database()
 
 	result = await db.get_collection("NikogotchiFeatures").find_one(
 		{"key": "NikogotchiFeatures"}, {"_id": 0, "nikogotchi": 1}
 	)
 
-	nikogotchi_info = result["nikogotchi"] if result else {}
+	nikogotchi_data: dict = result["nikogotchi"] if result else {}
+	by_nid: dict[str, NikogotchiMetadata] = {}
+	by_rarity: dict[Rarity, list[NikogotchiMetadata]] = {rarity: [] for rarity in Rarity}
+	for nid, info in nikogotchi_data.items():
+		if type(info) is not dict:
+			continue
+		try:
+			metadata = convert_to_class(info, nid)
+		except (KeyError, ValueError) as e:
+			# one bad entry shouldn't take every other nikogotchi down with it
+			logger.log(WARNING, f"Skipping nikogotchi {nid!r}, its entry is invalid: {e!r}")
+			continue
+		by_nid[nid] = metadata
+		by_rarity[metadata.rarity].append(metadata)
+
+	return NikogotchiRegistry(by_nid, by_rarity, time.monotonic())
+
+
+async def get_registry() -> NikogotchiRegistry:
+	global registry
+	if registry is not None and time.monotonic() - registry.loaded_at < catalog_ttl:
+		return registry
 
-	candidates = []
+	async with registry_lock:
+		if registry is not None and time.monotonic() - registry.loaded_at < catalog_ttl:
+			return registry
+		registry = await load_registry()
+		return registry
 
-	keys = list(nikogotchi_info.keys())
-	for key in keys:
-		if nikogotchi_info[key]["rarity"] == rarity:
-			candidates.append(key)
 
-	choice = random.choice(candidates)
+async def fetch_nikogotchi_metadata(nid: str) -> NikogotchiMetadata | None:
+	return (await get_registry()).by_nid.get(nid)
+
+
+async def pick_random_nikogotchi(rarity: int):
+	candidates = (await get_registry()).by_rarity[Rarity(rarity)]
 
-	return convert_to_class(nikogotchi_info[choice], choice)
+	return random.choice(candidates)
@@ -3,7 +3,7 @@ from interactions import Embed, SlashContext, User
 from utilities.database.schemas import UserData
 from utilities.localization.localization import Localization, lformat
 from utilities.message_decorations import Colors
-from utilities.shop.fetch_items import fetch_badge
+from utilities.shop.fetch_items import get_catalog
 
 
 async def earn_badge(
@@ -54,27 +54,27 @@ async def increment_value(
 	amount: int = 1,
 	target: User | None = None,
 ):
-	badges = await fetch_badge()
 	user = target or ctx.user
 
 	user_data = await UserData(_id=user.id).fetch()
 
-	await user_data.increment_key(value_to_increment, amount)
+	thresholds = (await get_catalog()).badge_thresholds.get(value_to_increment)
+	if thresholds is None:
+		# nothing to check it against, so the write can wait in the write-behind buffer
+		user_data.queue_increment(value_to_increment, by=amount)
+		return
 
-	get_value = user_data.__getattribute__(value_to_increment) + amount
+	# badges are checked against the database's value, not this process's copy
+	new_value = await user_data.increment(value_to_increment, amount)
+	old_value = new_value - amount
 
-	for badge, data in badges.items():
-		if data["type"] == value_to_increment:
-			if badge in user_data.owned_badges:
-				continue
-
-			if get_value < data["requirement"]:
-				continue
+	unlocked = {badge for badge, _ in thresholds.crossed(old_value, new_value)}
+	# badges reached before but never handed out still are, just without a message
+	for badge, data in thresholds.reached(new_value):
+		if badge in user_data.owned_badges:
+			continue
 
+		send_message = badge in unlocked
+		if amount == 6:
 			send_message = True
-
-			if get_value > data["requirement"]:
-				send_message = False
-			if amount == 6:
-				send_message = True
-			return await earn_badge(ctx, badge, data, user, send_message)
+		return await earn_badge(ctx, badge, data, user, send_message)
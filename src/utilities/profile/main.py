@@ -4,13 +4,14 @@ import textwrap
 from typing import Any
 
 from interactions import File, User
-from PIL import Image, ImageDraw, ImageEnhance, ImageFont, ImageSequence
+from PIL import Image, ImageDraw, ImageEnhance, ImageSequence
 from PIL.ImageFont import FreeTypeFont
 from termcolor import colored
 
 from utilities.config import debugging, get_config
 from utilities.database.schemas import UserData
 from utilities.emojis import emojis, make_emoji_cdn_url
+from utilities.fonts import get_font
 from utilities.localization.formatting import fnum
 from utilities.localization.localization import Localization, lformat, source_loc
 from utilities.message_decorations import Colors
@@ -40,7 +41,7 @@ async def load_profile_assets():
 	icons = []
 	assets = 0
 	try:
-		font = ImageFont.truetype(get_config("textbox.font"), 25)
+		font = get_font(get_config("textbox.font"), 25)
 		if debugging():
 			print(f"| Font: {font.getname()}")
 
@@ -1,10 +1,12 @@
 import os
 import random
+import time
 
 from interactions import Client, File
 from interactions.client.errors import TooManyChanges
 from termcolor import colored
 
+from utilities.cluster import in_cluster
 from utilities.config import debugging, get_config, on_prod
 from utilities.misc import set_avatar, set_status
 
@@ -54,11 +56,18 @@ async def roll_avatar(client: Client, log=True, print=print) -> None:
 statuses = get_config("bot.rolling.statuses", typecheck=list, ignore_None=True)
 
 
+def status_seed() -> int | None:
+	# every shard sets its own presence, in a cluster they all pick the same status for the same rolling interval
+	if not in_cluster():
+		return None
+	return int(time.time() // get_config("bot.rolling.interval", typecheck=int))
+
+
 async def roll_status(client: Client, log=True, print=print) -> None:
 	status = (
 		statuses
 		if isinstance(statuses, str)
-		else random.choice(statuses if statuses is not None else [None])
+		else random.Random(status_seed()).choice(statuses if statuses is not None else [None])
 		if isinstance(statuses, list)
 		else None
 	)
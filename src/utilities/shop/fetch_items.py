@@ -1,29 +1,108 @@
+import asyncio
+import time
+from bisect import bisect_right
 from collections import OrderedDict
+from dataclasses import dataclass
 
-from utilities.database.main import fetch_items
+from utilities.database.main import catalog_ttl, fetch_items, on_items_update
+
+
+@dataclass
+class BadgeThresholds:
+	"""Badges of one type, sorted by requirement so the ones a counter reached can be found with a bisect."""
+
+	requirements: list[int | float]
+	badges: list[tuple[str, dict]]
+
+	def reached(self, value: int | float) -> list[tuple[str, dict]]:
+		"""Badges whose requirement is at or below `value`."""
+		return self.badges[: bisect_right(self.requirements, value)]
+
+	def crossed(self, old_value: int | float, new_value: int | float) -> list[tuple[str, dict]]:
+		"""Badges unlocked by the counter going from `old_value` to `new_value`."""
+		return self.badges[bisect_right(self.requirements, old_value) : bisect_right(self.requirements, new_value)]
+
+
+@dataclass
+class Catalog:
+	"""Snapshot of the ItemData document, with the lookups commands need precomputed."""
+
+	items: dict
+	treasures: dict
+	backgrounds: dict
+	purchasable_backgrounds: dict
+	badges: OrderedDict  # sorted by badge id
+	badges_by_type: dict[str, list[tuple[str, dict]]]
+	badge_thresholds: dict[str, BadgeThresholds]
+	shop: dict
+	loaded_at: float
+
+
+catalog: Catalog | None = None
+catalog_lock = asyncio.Lock()
+
+
+def build_catalog(item_data: dict) -> Catalog:
+	badges = OrderedDict(sorted(item_data["badges"].items(), key=lambda x: x[1]["id"]))
+	badges_by_type: dict[str, list[tuple[str, dict]]] = {}
+	for name, data in badges.items():
+		badges_by_type.setdefault(data["type"], []).append((name, data))
+
+	badge_thresholds: dict[str, BadgeThresholds] = {}
+	for badge_type, typed_badges in badges_by_type.items():
+		by_requirement = sorted(typed_badges, key=lambda x: x[1]["requirement"])
+		badge_thresholds[badge_type] = BadgeThresholds(
+			[data["requirement"] for _, data in by_requirement], by_requirement
+		)
+
+	return Catalog(
+		items=item_data["items"],
+		treasures=item_data["treasures"],
+		backgrounds=item_data["backgrounds"],
+		purchasable_backgrounds={bg: val for bg, val in item_data["backgrounds"].items() if val["purchasable"]},
+		badges=badges,
+		badges_by_type=badges_by_type,
+		badge_thresholds=badge_thresholds,
+		shop=item_data["shop"],
+		loaded_at=time.monotonic(),
+	)
+
+
+def invalidate_catalog():
+	global catalog
+	catalog = None
+
+
+on_items_update(invalidate_catalog)
+
+
+async def get_catalog() -> Catalog:
+	"""Returns the cached catalog, reloading it from the database once it's older than `catalog_ttl` seconds."""
+	global catalog
+	if catalog is not None and time.monotonic() - catalog.loaded_at < catalog_ttl:
+		return catalog
+
+	async with catalog_lock:
+		# someone else might've loaded it while we waited
+		if catalog is not None and time.monotonic() - catalog.loaded_at < catalog_ttl:
+			return catalog
+		item_data = await fetch_items()
+		assert item_data is not None
+		catalog = build_catalog(item_data)
+		return catalog
 
 
 async def fetch_item():
-	item_data = await fetch_items()
-	assert item_data is not None
-	return item_data["items"]
+	return (await get_catalog()).items
 
 
 async def fetch_treasure():
-	item_data = await fetch_items()
-	assert item_data is not None
-	return item_data["treasures"]
+	return (await get_catalog()).treasures
 
 
 async def fetch_background():
-	item_data = await fetch_items()
-	assert item_data is not None
-	return item_data["backgrounds"]
+	return (await get_catalog()).backgrounds
 
 
 async def fetch_badge():
-	item_data = await fetch_items()
-	assert item_data is not None
-	item_data = item_data["badges"]
-
-	return OrderedDict(sorted(item_data.items(), key=lambda x: x[1]["id"]))
+	return (await get_catalog()).badges
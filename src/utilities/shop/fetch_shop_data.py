@@ -3,9 +3,10 @@ from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Literal
 
-from utilities.database.main import fetch_items, update_shop
+from utilities.database.main import update_shop
 from utilities.emojis import TreasureTypes
 from utilities.localization.localization import source_loc
+from utilities.shop.fetch_items import get_catalog
 
 
 @dataclass
@@ -39,15 +40,14 @@ class ShopData:
 
 
 async def fetch_shop_data():
-	items = await fetch_items()
-	assert items is not None
+	shop = (await get_catalog()).shop
 
 	shop_data = ShopData(
-		last_updated=items["shop"]["last_updated"],
-		background_stock=items["shop"]["backgrounds"],
-		treasure_stock=items["shop"]["treasures"],
-		stock=StockData(items["shop"]["stock"]["price"], items["shop"]["stock"]["value"]),
-		motd=items["shop"]["motd"],
+		last_updated=shop["last_updated"],
+		background_stock=list(shop["backgrounds"]),
+		treasure_stock=list(shop["treasures"]),
+		stock=StockData(shop["stock"]["price"], shop["stock"]["value"]),
+		motd=shop["motd"],
 	)
 
 	return shop_data
@@ -59,12 +59,10 @@ async def get_shop_data():
 	if (data.last_updated + timedelta(days=1)) > datetime.now():
 		return data
 
-	items = await fetch_items()
-	assert items is not None
+	catalog = await get_catalog()
 
-	all_bgs = items["backgrounds"]
-	backgrounds = {bg: val for bg, val in all_bgs.items() if val["purchasable"]}
-	treasures = items["treasures"]
+	backgrounds = catalog.purchasable_backgrounds
+	treasures = catalog.treasures
 	motds = source_loc.l("shop.motds", typecheck=tuple)
 
 	data.background_stock = random.sample(list(backgrounds.keys()), 3)
@@ -1,29 +1,46 @@
 import asyncio
 import os
 from datetime import datetime
-from typing import NamedTuple
+from typing import TYPE_CHECKING, NamedTuple
 
 import psutil
 
 from utilities.misc import exec
 
+if TYPE_CHECKING:
+	from interactions import Client
+
 
 class Stats(NamedTuple):
 	cpu: float
 	ram: float
 	last_updated: datetime
+	guilds: int | None = None  # in the whole cluster, None when not running in one
 
 
 stats = Stats(0.0, 0.0, datetime.now())
 
 
-async def system_monitor_task():
+async def system_monitor_task(client: "Client | None" = None):
+	"""In a cluster, every shard's stats are reported to the supervisor and `stats` holds the totals it sends back."""
+	# config imports this module, and cluster imports config
+	from utilities.cluster import SupervisorLink, shard
+
 	global stats
 	process = psutil.Process(os.getpid())
+	link = SupervisorLink(*shard.supervisor) if shard.supervisor is not None else None
+	process.cpu_percent()  # starts measuring, without blocking the event loop like an interval does
 
 	while True:
-		stats = Stats(process.cpu_percent(interval=5), process.memory_percent(), datetime.now())
-		await asyncio.sleep(1)
+		await asyncio.sleep(5)
+		stats = Stats(process.cpu_percent(), process.memory_percent(), datetime.now())
+		if link is None:
+			continue
+		totals = await link.report(
+			{"cpu": stats.cpu, "ram": stats.ram, "guilds": len(client.guilds) if client is not None else 0}
+		)
+		if totals is not None:
+			stats = Stats(totals["cpu"], totals["ram"], stats.last_updated, totals["guilds"])
 
 
 def get_stats():
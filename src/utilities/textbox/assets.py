@@ -0,0 +1,108 @@
+"""
+Decoded textbox images, shared by every render in a process.
+
+Bundles are decoded once and keyed by `AssetPaths`, which includes a version that's bumped whenever the files change.
+Render workers are forked before any of it is loaded, so each decodes the bundle on its first render, and a job with a
+newer version makes them load the new one.
+"""
+
+import io
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image
+
+from utilities.fonts import clear_fonts
+
+FACEPIC_SIZE = 96
+FACEPIC_POSITION = (496, 16)
+
+
+@dataclass(frozen=True)
+class AssetPaths:
+	background: str
+	borders: str
+	arrow: str
+	font: str
+	version: int = 0
+
+
+@dataclass
+class FacepicData:
+	key: str  # icon id, or the url for custom ones
+	data: bytes
+
+
+class TextboxAssets:
+	"""The images for one `AssetPaths`, in RGBA. Facepics and the borders with them drawn in are cached by key."""
+
+	def __init__(self, paths: AssetPaths, max_facepics: int = 256):
+		self.paths = paths
+		self.background = open_rgba(paths.background)
+		self.borders = open_rgba(paths.borders)
+		self.arrow = open_rgba(paths.arrow)
+		self.max_facepics = max_facepics
+		self._borders_with: OrderedDict[str, Image.Image] = OrderedDict()
+
+	def borders_with(self, facepic: FacepicData | None) -> Image.Image:
+		"""The borders with `facepic` in its spot, callers must not draw on it."""
+		if facepic is None:
+			return self.borders
+		borders = self._borders_with.get(facepic.key)
+		if borders is not None:
+			self._borders_with.move_to_end(facepic.key)
+			return borders
+		face = Image.open(io.BytesIO(facepic.data))
+		face = face.resize((FACEPIC_SIZE, FACEPIC_SIZE), resample=0).convert("RGBA")
+		borders = self._borders_with[facepic.key] = self.borders.copy()
+		borders.paste(face, FACEPIC_POSITION, mask=face)
+		if len(self._borders_with) > self.max_facepics:
+			self._borders_with.popitem(last=False)
+		return borders
+
+
+def open_rgba(path: str) -> Image.Image:
+	image = Image.open(path)
+	image.load()
+	return image if image.mode == "RGBA" else image.convert("RGBA")
+
+
+_bundles: dict[tuple[str, str, str], TextboxAssets] = {}
+
+
+def get_assets(paths: AssetPaths) -> TextboxAssets:
+	"""Gets the decoded bundle for `paths`, loading it if it was never loaded or its version changed."""
+	key = (paths.background, paths.borders, paths.arrow)
+	bundle = _bundles.get(key)
+	if bundle is None or bundle.paths != paths:
+		if bundle is not None:
+			clear_fonts()  # a new version, the font file may have changed too
+		bundle = _bundles[key] = TextboxAssets(paths)
+	return bundle
+
+
+asset_version = 0
+asset_directory = Path("src/data/images/textbox/")
+
+
+def current_paths(font: str) -> AssetPaths:
+	backgrounds = asset_directory / "backgrounds"
+	return AssetPaths(
+		background=str(backgrounds / "normal.png"),
+		borders=str(backgrounds / "normal_borders.png"),
+		arrow=str(backgrounds / "normal_arrow.png"),
+		font=font,
+		version=asset_version,
+	)
+
+
+def warm_assets(font: str) -> TextboxAssets:
+	return get_assets(current_paths(font))
+
+
+def reload_assets(font: str) -> TextboxAssets:
+	"""Bumps the version, so workers drop what they have too, and loads the files again."""
+	global asset_version
+	asset_version += 1
+	return warm_assets(font)
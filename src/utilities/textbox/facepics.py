@@ -39,15 +39,16 @@ class Face:
 	def get_icon_emoji(self) -> PartialEmoji:
 		return PartialEmoji(id=int(self.icon)) if self.icon else PartialEmoji(name="❔")
 
-	async def get_image(self, size: int | None) -> Image.Image:
+	async def get_bytes(self, size: int | None) -> bytes:
+		if self._custom:
+			return self._custom.getvalue() if isinstance(self._custom, io.BytesIO) else self._custom
 		loc: str | None = f"src/data/images/textbox/{self.icon}.png"
 		if not os.path.exists(loc):
 			loc = None
-		return Image.open(
-			self._custom
-			if self._custom
-			else await cached_get(loc if loc else make_emoji_cdn_url(emoji_id=self.icon, size=size))
-		)
+		return await cached_get(loc if loc else make_emoji_cdn_url(emoji_id=self.icon, size=size), raw=True)  # type: ignore
+
+	async def get_image(self, size: int | None) -> Image.Image:
+		return Image.open(io.BytesIO(await self.get_bytes(size)))
 
 	def __init__(self, path: str, icon: str | None = None):
 		self.path = path
@@ -1,32 +1,22 @@
 import inspect
 import io
-import re
 from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import Any, Callable, Literal, Sequence, get_args, get_origin
+from traceback import print_exc
+from typing import Any, Callable, Literal, get_args, get_origin
 
-import apng
-from grapheme import graphemes
-from PIL import Image, ImageDraw, ImageFont
+from termcolor import colored
 
 from utilities.config import get_config
 from utilities.localization.localization import Localization, lformat, source_loc
-from utilities.misc import cached_get
+from utilities.source_watcher import filter_path, subscribe
+from utilities.textbox.assets import FacepicData, asset_directory, current_paths, reload_assets, warm_assets
 from utilities.textbox.facepics import get_facepic
-from utilities.textbox.parsing import (
-	RGBA,
-	CharCommand,
-	CharSpeedModifier,
-	ColorModifier,
-	DelayCommand,
-	FacepicChangeCommand,
-	LineBreakCommand,
-	LocaleCommand,
-	init_token,
-	parse_textbox_text,
-)
-
-SupportedFiletypes = Literal["WEBP", "GIF", "APNG", "PNG", "JPEG"]
+from utilities.textbox.parsing import FacepicChangeCommand, LocaleCommand, parse_textbox_text
+from utilities.textbox.render_cache import job_key, render_cache
+from utilities.textbox.render_pool import RenderQueueFull, render_pool
+from utilities.textbox.renderer import FrameSpec, OutputTooLarge, RenderJob, SupportedFiletypes, render_job
+
 SupportedLocations = Literal[
 	"aleft",
 	"acenter",
@@ -190,92 +180,27 @@ class Frame(SerializableData):
 			) from e
 
 
-not_empty_empty_face: FacepicChangeCommand = init_token(type="@")  # type:ignore
-not_empty_empty_face.parse_input("clear")
-
-
-async def render_frame(
-	frame: Frame, animated: bool = True, loc: Localization = source_loc
-) -> tuple[list[Image.Image], list[int]]:
-	global not_empty_empty_face
-	word_wrap = True
-	background = Image.open(await cached_get(Path("src/data/images/textbox/backgrounds/", "normal.png")))
-	borders = Image.open(await cached_get(Path("src/data/images/textbox/backgrounds/", "normal_borders.png")))
-	burned_borders = borders.copy()
-	background.resize((background.height, background.width + 500))
-	font = ImageFont.truetype(await cached_get(Path(get_config("textbox.font")), force=True), 20)
-	text = Image.new("RGBA", (background.width, 999999), color=(255, 255, 255, 0))
-	text_x, text_y = 23, 16
-	max_text_width = background.width - (20 * 2)
-	text_height = background.height - (17 * 2)
-	images: list[Image.Image] = []
-	durations: Sequence[int] = []
-
-	frame_speed: float = 1.0
-
-	def put_frame(duration: int, speed_adjust: bool = True):
-		new = background.copy()
-		new.paste(text, (text_x, int(text_y)), mask=text)
-		new.paste(burned_borders, (0, 0), mask=burned_borders)
-		images.append(new)
-		if speed_adjust:
-			duration = int(duration / frame_speed)
-		durations.append(duration)
-
-	facepic_present = False
-
-	async def update_facepic(command: FacepicChangeCommand, delay: bool = False):
-		nonlocal burned_borders
-		nonlocal facepic_present
-		nonlocal max_text_width
-		burned_borders = borders.copy()
-		facepic = await get_facepic(command.facepic)
-		if facepic:
-			facepic_present = True
-			facepic = await facepic.get_image(size=96)
-			facepic = facepic.resize((96, 96), resample=0)
-			burned_borders.paste(facepic, (496, 16), mask=facepic.convert("RGBA"))
-		else:
-			facepic_present = False
-			facepic = None
-		if facepic_present and facepic:
-			max_text_width = background.width - (20 * 2) - facepic.width + 10
-		else:
-			max_text_width = background.width - (20 * 2)
-		if delay and animated:
-			put_frame(0)
-
-	def carriage_return():
-		nonlocal text_y
-		for i in range(4):
-			for i in range(5):
-				put_frame(0)
-				text_y -= 5.0
-
-	current_color = RGBA(255, 255, 255, 255)
+async def load_facepic(path: str) -> FacepicData | None:
+	facepic = await get_facepic(path)
+	if facepic:
+		return FacepicData(key=facepic.icon or path, data=await facepic.get_bytes(size=96))
+	return None
+
 
+async def prepare_frame(frame: Frame, animated: bool = True, loc: Localization = source_loc) -> FrameSpec:
+	"""Resolves everything in a frame that needs the bot (locale commands, facepics), so a worker can draw it."""
 	parsed = parse_textbox_text(frame.text) if frame.text else []
-	print(parsed)
-	text_offset = [0.0, 0.0]
+	commands: list = []
+	facepics: dict[str, FacepicData | None] = {}
+
 	first_facepic_command = next((cmd for cmd in parsed if isinstance(cmd, FacepicChangeCommand)), None)
-	if first_facepic_command and first_facepic_command.facepic != "":
-		await update_facepic(not_empty_empty_face)
+	starts_cleared = bool(first_facepic_command and first_facepic_command.facepic != "")
+	if starts_cleared:
+		facepics["clear"] = await load_facepic("clear")
 	i = 0
 	while i < len(parsed):
 		command = parsed[i]
-		if isinstance(command, FacepicChangeCommand):
-			if command.facepic != "":
-				await update_facepic(command)
-		elif isinstance(command, LineBreakCommand):
-			text_offset[1] += 25.0
-			text_offset[0] = 0.0
-		elif isinstance(command, DelayCommand):
-			put_frame(command.time, speed_adjust=False)
-		elif isinstance(command, ColorModifier):
-			current_color = command.color
-		elif isinstance(command, CharSpeedModifier):
-			frame_speed = command.speed if not (command.speed <= 0) else 0.25
-		elif isinstance(command, LocaleCommand):
+		if isinstance(command, LocaleCommand):
 			out = None
 			try:
 				out = parse_textbox_text(await lformat(loc, loc.l(command.path)))
@@ -284,77 +209,40 @@ async def render_frame(
 			i += 1
 			parsed[i:i] = out
 			continue
-		elif isinstance(command, (str, CharCommand)):
-			message = command
-			if isinstance(command, CharCommand):
-				# eventually i'll remove this duplicate if, after i handle the rest of the token types
-				message = command.text
-
-			if not isinstance(message, str):
-				message = f"[ ermm? unexpected type from command, got {type(message)} ]"
-			d = ImageDraw.Draw(text)
-			cumulative_text = ""
-			for word in re.findall(r"\S+\s*|\s+", message):  # TODO: regex alert
-				if (
-					text_offset[0] != 0
-					and word_wrap
-					and (d.textlength(word, font=font) + text_x + text_offset[0] + 1 > max_text_width)
-				):
-					text_offset[1] += 25.0
-					text_offset[0] = 0.0
-				for cluster in list(graphemes(word)):  # type: ignore
-					if cluster is None:
-						cluster: str = ""
-					cumulative_text += cluster
-					duration = 50
-					match cluster:
-						case "." | "!" | "?" | "．" | "？" | "！":
-							duration = 600
-						case "," | "，":
-							duration = 100
-					if text_offset[0] + 15 > max_text_width:
-						text_offset[1] += 25.0
-						text_offset[0] = 0.0
-					if text_y + text_offset[1] > background.height - (17 * 2):
-						carriage_return()
-					try:
-						d.text(
-							(text_offset[0], text_offset[1]),
-							cluster,
-							font=font,
-							fill=current_color,
-						)
-						text_offset[0] += d.textlength(
-							cluster, font=font
-						)  # TODO: there is a better way https://pillow.readthedocs.io/en/stable/reference/ImageText.html#example
-					except:
-						pass
-					if animated:
-						put_frame(duration)
-
+		if isinstance(command, FacepicChangeCommand) and command.facepic != "" and command.facepic not in facepics:
+			facepics[command.facepic] = await load_facepic(command.facepic)
+		commands.append(command)
 		i += 1
-	put_frame(0)
-	return (images, durations)
+
+	return FrameSpec(
+		commands=commands,
+		facepics=facepics,
+		starts_cleared=starts_cleared,
+		animated=animated,
+		end_delay=frame.options.end_delay,
+		end_arrow_bounces=frame.options.end_arrow_bounces,
+		end_arrow_delay=frame.options.end_arrow_delay,
+	)
 
 
-# >>> bounce(2, 3)
-# [1, 2, 3, 2, 1, 2, 3, 2, 1]  # noqa: ERA001
-def bounce(times, height=3):
-	pattern = []
-	length = ((height + (height - 2)) * times) + 1
-	cycle_length = (height * 2) - 2
+def textbox_font() -> str:
+	return str(Path(get_config("textbox.font")))
 
-	for i in range(length):
-		position = i % cycle_length
 
-		if position < height:
-			value = position + 1
-		else:
-			value = (cycle_length - position) + 1
+def on_assets_update(event):
+	print(colored("─ Reloading textbox assets ...", "yellow"), end="")
+	try:
+		reload_assets(textbox_font())
+	except Exception:
+		print(colored(" FAILED", "red"))
+		print_exc()
+		return
+	print(" ─ ─ ─ ")
 
-		pattern.append(value)
 
-	return pattern
+subscribe(filter_path(str(asset_directory)), on_assets_update)
+subscribe(filter_path(textbox_font()), on_assets_update)
+warm_assets(textbox_font())  # for renders in threads, worker processes load them on their first render
 
 
 async def render_textbox_frames(
@@ -364,114 +252,41 @@ async def render_textbox_frames(
 	frame_index: int | None = None,
 	loops: int = 0,
 	loc: Localization = source_loc,
+	owner: Any = None,
 ) -> io.BytesIO:
+	"""
+	Renders frames in the render pool, or gets them from the render cache if the same thing was rendered before.
+
+	`owner` (a user id, an ip) is who the per-user render limit counts against.
+	"""
 	if len(frames) == 0:
 		raise ValueError("Provide atleast one frame")
-	all_images: list[Image.Image] = []
-	all_durations: list[int] = []
-	buffer = io.BytesIO()
-	if filetype in ("JPEG", "PNG"):
-		if not frame_index:
-			frame_index = 0
-		frame = frames[int(frame_index)]
-		image = (await render_frame(frame, False, loc))[0][0]
-		if filetype == "JPEG":
-			buffer = io.BytesIO()
-			if image.mode == "RGBA":
-				rgb_image = Image.new("RGB", image.size, (255, 255, 255))
-				rgb_image.paste(image, mask=image.split()[3])
-				rgb_image.save(buffer, format="JPEG", quality=quality)
-			else:
-				image.save(buffer, format="JPEG", quality=quality)
-		else:
-			image.save(
-				buffer,
-				format="PNG",
-				compress_level=9
-				- int(max(0, min(100, quality)) * 9 / 100),  #  quality = 0->100 = compress_level = 9->0
-			)
-		return buffer
-
-	for frame in frames:
-		images, durations = await render_frame(frame, frame.options.animated)
-		all_images.extend(images)
-		all_durations.extend(durations)
-
-		# make the ending thing
-		arrow = Image.open(await cached_get(Path("src/data/images/textbox/backgrounds/", "normal_arrow.png")))
-		arrow_rgba = arrow.convert("RGBA")
-		last_frame = all_images[-1]
-		all_durations[-1] = frame.options.end_delay
-		bounce_frames = [
-			":3",
-			last_frame.copy(),
-			last_frame.copy(),
-			last_frame.copy(),
-		]
-		bounce_frames[1].paste(arrow, (299, 119), arrow_rgba)
-		bounce_frames[2].paste(arrow, (299, 119 - 1), arrow_rgba)
-		bounce_frames[3].paste(arrow, (299, 119 - 2), arrow_rgba)
-
-		for i in bounce(frame.options.end_arrow_bounces, 3):
-			all_images.append(bounce_frames[i])
-			all_durations.append(frame.options.end_arrow_delay)
-	all_images.append(last_frame.copy())
-	all_durations.append(150)
-
-	lowest_fastest = 0
-	match filetype:
-		case "WEBP":
-			lowest_fastest = 11
-		case "GIF":
-			lowest_fastest = 20
-		case "APNG":
-			lowest_fastest = 11
-	# flooring the durations, because if it's lower than a certain number the browser/app just slows it down to 100ms i think? i'm not sure
-	# here's a thing one of the developer working on webp said about this
-	# https://groups.google.com/a/webmproject.org/g/webp-discuss/c/Yd0sstcZGlU/m/4PfkB4aVa8cJ?pli=1  # noqa: ERA001
-	#
-	# all of these are the lowest i could get in firefox/android discord app
-	for i in range(len(all_durations)):
-		if all_durations[i] <= 0:
-			all_durations[i] = lowest_fastest
-	match filetype:
-		case "WEBP":
-			all_images[0].save(
-				buffer,
-				format="WEBP",
-				save_all=True,
-				append_images=all_images[1:],
-				duration=all_durations,
-				quality=quality,
-				loops=loops,
-			)
-		case "APNG":
-			png_images = []
-			for img in all_images:
-				temp_buffer = io.BytesIO()
-				img.save(temp_buffer, format="PNG")
-				temp_buffer.seek(0)
-				png_obj = apng.PNG.from_bytes(temp_buffer.getvalue())
-				png_images.append(png_obj)
-
-			animation = apng.APNG(
-				num_plays=loops,
-			)
-
-			for i, png_obj in enumerate(png_images):
-				animation.append(png_obj, delay=int(all_durations[i]), delay_den=1000)
-
-			apng_bytes = animation.to_bytes()
-			buffer = io.BytesIO(apng_bytes)
-		case "GIF":
-			all_images[0].save(
-				buffer,
-				format="GIF",
-				save_all=True,
-				append_images=all_images[1:],
-				duration=all_durations,
-				optimize=True,
-				loops=loops,
-			)
-	buffer.seek(0)
-	return buffer
+	still = filetype in ("JPEG", "PNG")
+	if still:
+		frames = [frames[int(frame_index or 0)]]
+
+	job = RenderJob(
+		frames=[await prepare_frame(frame, frame.options.animated and not still, loc) for frame in frames],
+		assets=current_paths(textbox_font()),
+		filetype=filetype,
+		quality=quality,
+		loops=loops,
+		still=still,
+		max_size=get_config("textbox.limits.filesize", typecheck=int, ignore_None=True),
+	)
+	return io.BytesIO(
+		await render_cache.get_or_render(job_key(job), lambda: render_pool.run(render_job, job, owner=owner))
+	)
+
+
+async def render_error(loc: Localization, error: RenderQueueFull | OutputTooLarge) -> str:
+	"""What to tell someone whose render was rejected or came out too large, `str(error)` when no locale has the key."""
+	if isinstance(error, OutputTooLarge):
+		key, variables = "textbox.errors.too_large", {"limit": round(error.limit / 1024 / 1024, 2)}
+	else:
+		key = f"textbox.errors.{'too_many_renders' if error.own else 'queue_full'}"
+		variables = {"waiting": error.waiting}
+	message = loc.l(key, typecheck=Any, return_None_on_not_found=True)
+	if not isinstance(message, str):
+		return str(error)
+	return await lformat(loc, message, **variables)
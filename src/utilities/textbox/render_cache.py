@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from traceback import print_exc
+from typing import Awaitable, Callable
+
+import aiofiles
+
+from utilities.config import get_config
+from utilities.textbox.renderer import RenderJob
+
+
+def job_key(job: RenderJob) -> str:
+	"""
+	Hash of everything that affects a render's output.
+
+	Jobs are already resolved, so the locale's strings and facepic images are part of them. The asset files are
+	included by modification time, so editing them changes every key.
+	"""
+	digest = hashlib.sha256()
+
+	def feed(*parts):
+		for part in parts:
+			digest.update(repr(part).encode())
+			digest.update(b"\0")
+
+	feed(job.filetype, job.quality, job.loops, job.still)
+	for path in (job.assets.background, job.assets.borders, job.assets.arrow, job.assets.font):
+		feed(path, os.stat(path).st_mtime_ns if os.path.exists(path) else None)
+	for spec in job.frames:
+		feed(spec.animated, spec.end_delay, spec.end_arrow_bounces, spec.end_arrow_delay, spec.starts_cleared)
+		feed(spec.commands)
+		for path, facepic in sorted(spec.facepics.items()):
+			feed(path, (facepic.key, hashlib.sha256(facepic.data).hexdigest()) if facepic else None)
+	return digest.hexdigest()
+
+
+class RenderCache:
+	"""
+	Rendered textboxes by `job_key`, kept in memory up to `max_bytes` and, optionally, on disk up to `disk_max_bytes`.
+
+	Identical renders that are asked for while one is already running wait for it instead of rendering again.
+	"""
+
+	def __init__(self, max_bytes: int, disk_path: str | None = None, disk_max_bytes: int = 0):
+		self.max_bytes = max_bytes
+		self.disk_path = Path(disk_path) if disk_path else None
+		self.disk_max_bytes = disk_max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.joined = 0
+		self.evictions = 0
+		self._entries: OrderedDict[str, bytes] = OrderedDict()
+		self._pending: dict[str, asyncio.Task[bytes]] = {}
+		self._disk_bytes: int | None = None
+
+	def _remember(self, key: str, data: bytes):
+		if len(data) > self.max_bytes:
+			return
+		old = self._entries.pop(key, None)
+		if old is not None:
+			self.bytes -= len(old)
+		self._entries[key] = data
+		self.bytes += len(data)
+		while self.bytes > self.max_bytes:
+			_, evicted = self._entries.popitem(last=False)
+			self.bytes -= len(evicted)
+			self.evictions += 1
+
+	async def _read_disk(self, key: str) -> bytes | None:
+		if self.disk_path is None:
+			return None
+		path = self.disk_path / key
+		try:
+			async with aiofiles.open(path, "rb") as f:
+				data = await f.read()
+		except FileNotFoundError:
+			return None
+		os.utime(path)  # keeps the least recently used files first when trimming
+		return data
+
+	def _trim_disk(self):
+		assert self.disk_path is not None
+		files = sorted(self.disk_path.iterdir(), key=lambda file: file.stat().st_mtime)
+		total = sum(file.stat().st_size for file in files)
+		for file in files:
+			if total <= self.disk_max_bytes:
+				break
+			total -= file.stat().st_size
+			file.unlink(missing_ok=True)
+		self._disk_bytes = total
+
+	async def _write_disk(self, key: str, data: bytes):
+		if self.disk_path is None or len(data) > self.disk_max_bytes:
+			return
+		try:
+			self.disk_path.mkdir(parents=True, exist_ok=True)
+			if self._disk_bytes is None:
+				await asyncio.to_thread(self._trim_disk)
+			temp_path = self.disk_path / f".{key}.tmp"
+			async with aiofiles.open(temp_path, "wb") as f:
+				await f.write(data)
+			os.replace(temp_path, self.disk_path / key)
+			self._disk_bytes = (self._disk_bytes or 0) + len(data)
+			if self._disk_bytes > self.disk_max_bytes:
+				await asyncio.to_thread(self._trim_disk)
+		except OSError:
+			print_exc()
+
+	async def get_or_render(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+		data = self._entries.get(key)
+		if data is not None:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return data
+
+		task = self._pending.get(key)
+		if task is not None:
+			self.joined += 1
+		else:
+			# its own task, so whoever started it going away (an interaction timing out) doesn't cancel it for the rest
+			task = self._pending[key] = asyncio.create_task(self._load(key, render))
+			task.add_done_callback(lambda task: self._done(key, task))
+		return await asyncio.shield(task)
+
+	async def _load(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+		data = await self._read_disk(key)
+		if data is not None:
+			self.disk_hits += 1
+		else:
+			self.misses += 1
+			data = await render()
+			await self._write_disk(key, data)
+		self._remember(key, data)
+		return data
+
+	def _done(self, key: str, task: asyncio.Task[bytes]):
+		if self._pending.get(key) is task:
+			del self._pending[key]
+		if not task.cancelled():
+			task.exception()  # everyone waiting might have gone, this keeps asyncio from complaining about it
+
+	def clear(self):
+		self._entries.clear()
+		self.bytes = 0
+
+	def stats(self) -> dict[str, int | float | None]:
+		total = self.hits + self.disk_hits + self.misses
+		return {
+			"entries": len(self._entries),
+			"bytes": self.bytes,
+			"disk_bytes": self._disk_bytes,
+			"hits": self.hits,
+			"disk_hits": self.disk_hits,
+			"misses": self.misses,
+			"joined": self.joined,
+			"evictions": self.evictions,
+			"hit_rate": round((self.hits + self.disk_hits) / total, 3) if total else 0.0,
+		}
+
+
+render_cache = RenderCache(
+	max_bytes=get_config("textbox.cache.size", typecheck=int, ignore_None=True) or 64 * 1024 * 1024,
+	disk_path=get_config("textbox.cache.disk", ignore_None=True),
+	disk_max_bytes=get_config("textbox.cache.disk-size", typecheck=int, ignore_None=True) or 512 * 1024 * 1024,
+)
@@ -0,0 +1,152 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging import WARNING
+from typing import Any, Callable, TypeVar
+
+from utilities.config import get_config
+from utilities.logging import createLogger
+
+T = TypeVar("T")
+
+logger = createLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+	"""Raised instead of queueing a render when too many are already waiting, `own` when it's the owner's own."""
+
+	def __init__(self, waiting: int, own: bool = False):
+		super().__init__(waiting, own)
+		self.waiting = waiting
+		self.own = own
+
+	def __str__(self):
+		if self.own:
+			return f"You already have {self.waiting} textboxes being rendered"
+		return f"There are too many textboxes being rendered right now ({self.waiting} waiting)"
+
+
+class RenderPool:
+	"""
+	Runs textbox renders off the event loop, in worker processes.
+
+	At most `workers` renders run at once and at most `max_queue` wait behind them, anything past that is rejected
+	right away. Every owner (usually a user id) gets `per_owner` renders at a time, and `owner_queue` more waiting for
+	their turn.
+
+	Workers are forked by `start`, because spawning them would re-run `main.py`. Where fork isn't available (or
+	`workers` is 0, or `start` wasn't called) renders run in threads instead, which still keeps Pillow off the event
+	loop.
+	"""
+
+	def __init__(self, workers: int, max_queue: int, per_owner: int, owner_queue: int):
+		self.workers = workers
+		self.max_queue = max_queue
+		self.per_owner = per_owner
+		self.owner_queue = owner_queue
+		self.waiting = 0
+		self.running = 0
+		self.completed = 0
+		self.failed = 0
+		self.rejected = 0
+		self.render_time = 0.0
+		self._executor: Executor | None = None
+		self._slots: asyncio.Semaphore | None = None
+		self._owners: dict[Any, tuple[asyncio.Semaphore, int]] = {}
+
+	def start(self):
+		"""
+		Forks the workers. This has to happen before anything starts a thread (the source watcher, ICU preparsing), a
+		forked process only gets the thread that forked it, and any lock another thread was holding stays locked.
+		"""
+		if self._executor is not None or self.workers <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+			return
+		self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+		self._executor.submit(int)  # it forks all of its workers on the first submit
+
+	@property
+	def executor(self) -> Executor:
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor(max(self.workers, 1), thread_name_prefix="textbox-render")
+		return self._executor
+
+	def _acquire_owner(self, owner: Any) -> asyncio.Semaphore:
+		semaphore, users = self._owners.get(owner, (None, 0))
+		if owner is not None and users >= self.per_owner + self.owner_queue:
+			self.rejected += 1
+			raise RenderQueueFull(users, own=True)
+		if semaphore is None:
+			semaphore = asyncio.Semaphore(self.per_owner)
+		self._owners[owner] = (semaphore, users + 1)
+		return semaphore
+
+	def _release_owner(self, owner: Any):
+		semaphore, users = self._owners[owner]
+		if users <= 1:
+			del self._owners[owner]
+		else:
+			self._owners[owner] = (semaphore, users - 1)
+
+	async def run(self, fn: Callable[..., T], *args, owner: Any = None) -> T:
+		"""Runs `fn(*args)` in a worker, `fn` and its arguments have to be picklable."""
+		if self.waiting >= self.max_queue:
+			self.rejected += 1
+			raise RenderQueueFull(self.waiting)
+		if self._slots is None:
+			self._slots = asyncio.Semaphore(max(self.workers, 1))
+
+		owner_slot = self._acquire_owner(owner)
+		self.waiting += 1
+		queued = True
+		try:
+			async with owner_slot, self._slots:
+				self.waiting -= 1
+				queued = False
+				self.running += 1
+				start = time.perf_counter()
+				executor = self.executor
+				try:
+					result = await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+				except BrokenProcessPool:
+					# a worker died (probably killed for using too much memory). forking new ones now that threads are
+					# running isn't safe, so the rest of the renders run in threads
+					if self._executor is executor:
+						logger.log(WARNING, "A render worker died, rendering in threads from now on")
+						self._executor = None
+					raise
+				finally:
+					self.running -= 1
+					self.render_time += time.perf_counter() - start
+		except BaseException:
+			self.failed += 1
+			raise
+		finally:
+			if queued:
+				self.waiting -= 1
+			self._release_owner(owner)
+		self.completed += 1
+		return result
+
+	def stats(self) -> dict[str, int | float]:
+		finished = self.completed + self.failed
+		return {
+			"workers": self.workers,
+			"waiting": self.waiting,
+			"running": self.running,
+			"completed": self.completed,
+			"failed": self.failed,
+			"rejected": self.rejected,
+			"average_ms": round(self.render_time / finished * 1000, 1) if finished else 0.0,
+		}
+
+
+workers = get_config("textbox.render.workers", typecheck=int, ignore_None=True)
+owner_queue = get_config("textbox.render.per-user-queue", typecheck=int, ignore_None=True)
+render_pool = RenderPool(
+	workers=2 if workers is None else workers,
+	max_queue=get_config("textbox.render.queue", typecheck=int, ignore_None=True) or 32,
+	per_owner=get_config("textbox.render.per-user", typecheck=int, ignore_None=True) or 1,
+	owner_queue=2 if owner_queue is None else owner_queue,
+)
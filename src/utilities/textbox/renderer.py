@@ -0,0 +1,502 @@
+"""
+The Pillow side of textbox rendering.
+
+Everything here is synchronous and works on plain data (see `RenderJob`), so it can run in a render worker process
+without touching the event loop, the database or the localization. `mediagen` prepares the jobs.
+"""
+
+import io
+import re
+from dataclasses import dataclass
+from math import ceil, floor
+from typing import Generator, Iterable, Iterator, Literal
+
+import apng
+from grapheme import graphemes
+from PIL import Image, ImageChops
+
+from utilities.fonts import GlyphAtlas, get_atlas
+from utilities.textbox.assets import FACEPIC_SIZE, AssetPaths, FacepicData, get_assets
+from utilities.textbox.parsing import (
+	RGBA,
+	CharCommand,
+	CharSpeedModifier,
+	ColorModifier,
+	DelayCommand,
+	FacepicChangeCommand,
+	LineBreakCommand,
+	TOKENS,
+)
+
+SupportedFiletypes = Literal["WEBP", "GIF", "APNG", "PNG", "JPEG"]
+
+# fcTL ops, frames only carry the box that changed and replace what's under them
+APNG_DISPOSE_NONE = 0
+APNG_BLEND_SOURCE = 0
+# ANMF flags, same thing for WEBP frames
+WEBP_NO_BLEND = 0b10
+WEBP_FRAME_CHUNKS = (b"ALPH", b"VP8 ", b"VP8L")
+
+
+class OutputTooLarge(ValueError):
+	"""Raised while encoding, as soon as the output is bigger than `limit`, the job's `max_size`."""
+
+	def __init__(self, limit: int):
+		super().__init__(limit)  # only what's in args makes it back from a worker process
+		self.limit = limit
+
+	def __str__(self):
+		return f"Generated file is too large (over {self.limit / 1024 / 1024:.2f} MB)."
+
+
+@dataclass
+class FrameSpec:
+	"""A textbox frame with everything async already resolved: locale commands expanded and facepics fetched."""
+
+	commands: list[str | TOKENS]
+	facepics: dict[str, FacepicData | None]  # facepic path -> image, None when there's no face to draw
+	starts_cleared: bool = False  # whether the empty face is put up before the text starts
+	animated: bool = True
+	end_delay: int = 150
+	end_arrow_bounces: int = 4
+	end_arrow_delay: int = 150
+
+
+@dataclass
+class RenderJob:
+	frames: list[FrameSpec]
+	assets: AssetPaths
+	filetype: SupportedFiletypes = "WEBP"
+	quality: int = 100
+	loops: int = 0
+	still: bool = False  # only render the first frame, unanimated
+	max_size: int | None = None  # bytes, encoding stops with `OutputTooLarge` once the output gets past this
+
+
+@dataclass
+class FrameDelta:
+	"""A frame, stored as the part of the canvas that changed since the frame before it."""
+
+	box: tuple[int, int, int, int] | None  # None when it's the same as the frame before
+	image: Image.Image | None
+	duration: int
+
+
+class Compositor:
+	"""
+	Keeps the composited textbox (background, text, borders) up to date, only recompositing what changed.
+
+	The text layer is only a bit taller than the textbox, rows that scroll off the top get dropped.
+	"""
+
+	def __init__(self, background: Image.Image, borders: Image.Image, text_x: int, text_y: float):
+		self.background = background
+		self.borders = borders
+		self.text_x = text_x
+		self.text_y = text_y
+		self.text = Image.new("RGBA", (background.width, background.height * 2), color=(255, 255, 255, 0))
+		self.text_top = 0  # how many rows of text were dropped off the top of the layer
+		self.canvas = background.copy()
+		self.dirty: tuple[int, int, int, int] | None = (0, 0, *background.size)
+
+	@property
+	def text_position(self) -> tuple[int, int]:
+		"""Where the text layer goes on the canvas."""
+		return self.text_x, int(self.text_y) + self.text_top
+
+	def mark_dirty(self, box: tuple[int, int, int, int] | None = None):
+		width, height = self.canvas.size
+		box = box or (0, 0, width, height)
+		box = (max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height))
+		if box[0] >= box[2] or box[1] >= box[3]:
+			return
+		if self.dirty:
+			box = (
+				min(box[0], self.dirty[0]),
+				min(box[1], self.dirty[1]),
+				max(box[2], self.dirty[2]),
+				max(box[3], self.dirty[3]),
+			)
+		self.dirty = box
+
+	def set_borders(self, borders: Image.Image):
+		self.borders = borders
+		self.mark_dirty()
+
+	def scroll(self, by: float):
+		self.text_y -= by
+		hidden = -int(self.text_y) - self.text_top
+		if hidden > 0:
+			width, height = self.text.size
+			self.text.paste(self.text.crop((0, hidden, width, height)), (0, 0))
+			self.text.paste((255, 255, 255, 0), (0, height - hidden, width, height))
+			self.text_top += hidden
+		self.mark_dirty()
+
+	def draw_text(self, xy: tuple[float, float], text: str, atlas: GlyphAtlas, fill: RGBA):
+		"""Draws text at `xy` (relative to where the text starts) and marks the area it covers as changed."""
+		box = atlas.draw(self.text, (xy[0], xy[1] - self.text_top), text, fill)
+		if box is None:
+			return
+		left, top, right, bottom = box
+		x, y = self.text_position
+		self.mark_dirty((floor(left) + x, floor(top) + y, ceil(right) + x, ceil(bottom) + y))
+
+	def frame(self, duration: int) -> FrameDelta:
+		box = self.dirty
+		if box is None:
+			return FrameDelta(None, None, duration)
+		x, y = self.text_position
+		region = self.background.crop(box)
+		text = self.text.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+		region.paste(text, (0, 0), mask=text)
+		borders = self.borders.crop(box)
+		region.paste(borders, (0, 0), mask=borders)
+		self.canvas.paste(region, box[:2])
+		self.dirty = None
+		return FrameDelta(box, region, duration)
+
+
+def full_frames(deltas: Iterable[FrameDelta], size: tuple[int, int]) -> Iterator[Image.Image]:
+	"""Turns deltas back into whole frames, one at a time."""
+	canvas = Image.new("RGBA", size)
+	for delta in deltas:
+		if delta.image is not None and delta.box is not None:
+			canvas.paste(delta.image, delta.box[:2])
+		yield canvas.copy()
+
+
+def shrink_deltas(
+	deltas: Iterable[FrameDelta], size: tuple[int, int], min_duration: int = 0, align: int = 1
+) -> Iterator[FrameDelta]:
+	"""
+	Gets deltas ready for encoding: every delta is cut down to the box that really changed, and frames that don't
+	change anything are merged into the frame before them. Durations at or below 0 become `min_duration` first.
+
+	A delta is only yielded once the next change comes in, since its duration isn't final before that. Boxes start
+	on multiples of `align`.
+	"""
+	canvas = Image.new("RGBA", size)
+	pending: FrameDelta | None = None
+	for delta in deltas:
+		duration = delta.duration if delta.duration > 0 else min_duration
+		changed = None
+		if delta.image is not None and delta.box is not None:
+			x, y = delta.box[:2]
+			changed = ImageChops.difference(delta.image, canvas.crop(delta.box)).getbbox(alpha_only=False)
+			if changed is not None:
+				canvas.paste(delta.image, (x, y))
+				left, top = changed[0] + x, changed[1] + y
+				changed = (left - left % align, top - top % align, changed[2] + x, changed[3] + y)
+
+		if pending is None:
+			pending = FrameDelta((0, 0, *size), canvas.copy(), duration)
+		elif changed is None:
+			pending.duration += duration
+		else:
+			yield pending
+			pending = FrameDelta(changed, canvas.crop(changed), duration)
+	if pending is not None:
+		yield pending
+
+
+def draw_frame(
+	spec: FrameSpec, assets: AssetPaths, animated: bool = True
+) -> Generator[FrameDelta, None, Image.Image]:
+	"""
+	Draws a frame, yielding its animation as deltas while it goes. Returns what the textbox looks like at the end.
+
+	The last delta lasts `spec.end_delay`.
+	"""
+	word_wrap = True
+	bundle = get_assets(assets)
+	background = bundle.background
+	borders = bundle.borders
+	atlas = get_atlas(assets.font, 20)
+	compositor = Compositor(background, borders, 23, 16)
+	max_text_width = background.width - (20 * 2)
+	pending: list[FrameDelta] = []  # put out by the helpers below, yielded by the loop
+
+	frame_speed: float = 1.0
+
+	def put_frame(duration: int, speed_adjust: bool = True):
+		if speed_adjust:
+			duration = int(duration / frame_speed)
+		pending.append(compositor.frame(duration))
+
+	def update_facepic(path: str, delay: bool = False):
+		nonlocal max_text_width
+		facepic = spec.facepics.get(path)
+		compositor.set_borders(bundle.borders_with(facepic))
+		if facepic:
+			max_text_width = background.width - (20 * 2) - FACEPIC_SIZE + 10
+		else:
+			max_text_width = background.width - (20 * 2)
+		if delay and animated:
+			put_frame(0)
+
+	def carriage_return():
+		for i in range(4):
+			for i in range(5):
+				put_frame(0)
+				compositor.scroll(5.0)
+
+	current_color = RGBA(255, 255, 255, 255)
+
+	text_x = compositor.text_x
+	text_offset = [0.0, 0.0]
+	if spec.starts_cleared:
+		update_facepic("clear")
+	for command in spec.commands:
+		if isinstance(command, FacepicChangeCommand):
+			if command.facepic != "":
+				update_facepic(command.facepic)
+		elif isinstance(command, LineBreakCommand):
+			text_offset[1] += 25.0
+			text_offset[0] = 0.0
+		elif isinstance(command, DelayCommand):
+			put_frame(command.time, speed_adjust=False)
+		elif isinstance(command, ColorModifier):
+			current_color = command.color
+		elif isinstance(command, CharSpeedModifier):
+			frame_speed = command.speed if not (command.speed <= 0) else 0.25
+		elif isinstance(command, (str, CharCommand)):
+			message = command
+			if isinstance(command, CharCommand):
+				message = command.text
+
+			if not isinstance(message, str):
+				message = f"[ ermm? unexpected type from command, got {type(message)} ]"
+			for word in re.findall(r"\S+\s*|\s+", message):  # TODO: regex alert
+				if (
+					text_offset[0] != 0
+					and word_wrap
+					and (atlas.length(word) + text_x + text_offset[0] + 1 > max_text_width)
+				):
+					text_offset[1] += 25.0
+					text_offset[0] = 0.0
+				for cluster in list(graphemes(word)):  # type: ignore
+					if cluster is None:
+						cluster: str = ""
+					duration = 50
+					match cluster:
+						case "." | "!" | "?" | "．" | "？" | "！":
+							duration = 600
+						case "," | "，":
+							duration = 100
+					if text_offset[0] + 15 > max_text_width:
+						text_offset[1] += 25.0
+						text_offset[0] = 0.0
+					if compositor.text_y + text_offset[1] > background.height - (17 * 2):
+						carriage_return()
+					try:
+						compositor.draw_text((text_offset[0], text_offset[1]), cluster, atlas, current_color)
+						text_offset[0] += atlas.length(cluster)
+					except:
+						pass
+					if animated:
+						put_frame(duration)
+					yield from pending
+					pending.clear()
+		yield from pending
+		pending.clear()
+	put_frame(spec.end_delay, speed_adjust=False)
+	yield from pending
+	return compositor.canvas
+
+
+# >>> bounce(2, 3)
+# [1, 2, 3, 2, 1, 2, 3, 2, 1]  # noqa: ERA001
+def bounce(times, height=3):
+	pattern = []
+	length = ((height + (height - 2)) * times) + 1
+	cycle_length = (height * 2) - 2
+
+	for i in range(length):
+		position = i % cycle_length
+
+		if position < height:
+			value = position + 1
+		else:
+			value = (cycle_length - position) + 1
+
+		pattern.append(value)
+
+	return pattern
+
+
+def encode_still(image: Image.Image, filetype: SupportedFiletypes, quality: int) -> bytes:
+	buffer = io.BytesIO()
+	if filetype == "JPEG":
+		if image.mode == "RGBA":
+			rgb_image = Image.new("RGB", image.size, (255, 255, 255))
+			rgb_image.paste(image, mask=image.split()[3])
+			rgb_image.save(buffer, format="JPEG", quality=quality)
+		else:
+			image.save(buffer, format="JPEG", quality=quality)
+	else:
+		image.save(
+			buffer,
+			format="PNG",
+			compress_level=9 - int(max(0, min(100, quality)) * 9 / 100),  #  quality = 0->100 = compress_level = 9->0
+		)
+	return buffer.getvalue()
+
+
+class AnimatedWebP:
+	"""
+	Animated WEBP that's written a frame at a time. Frames are encoded on their own as still WEBPs and wrapped in ANMF
+	chunks at their offset, so only compressed frames are kept around.
+	"""
+
+	def __init__(self, size: tuple[int, int], loops: int = 0):
+		self.size = size
+		self.loops = loops
+		self.frames: list[bytes] = []
+		self.length = 0
+
+	@staticmethod
+	def chunk(fourcc: bytes, payload: bytes) -> bytes:
+		return fourcc + len(payload).to_bytes(4, "little") + payload + b"\0" * (len(payload) % 2)
+
+	@staticmethod
+	def chunks(data: bytes) -> Iterator[tuple[bytes, bytes]]:
+		"""The (fourcc, whole chunk) pairs of a WEBP file."""
+		i = 12  # RIFF header
+		while i < len(data):
+			length = int.from_bytes(data[i + 4 : i + 8], "little")
+			end = i + 8 + length + length % 2
+			yield data[i : i + 4], data[i:end]
+			i = end
+
+	def append(self, image: Image.Image, offset: tuple[int, int], duration: int, quality: int):
+		"""Adds a frame, `offset` has to be even."""
+		buffer = io.BytesIO()
+		image.save(buffer, format="WEBP", quality=quality)
+		frame_data = b"".join(chunk for fourcc, chunk in self.chunks(buffer.getvalue()) if fourcc in WEBP_FRAME_CHUNKS)
+		header = b"".join(
+			value.to_bytes(3, "little")
+			for value in (offset[0] // 2, offset[1] // 2, image.width - 1, image.height - 1, min(duration, 0xFFFFFF))
+		)
+		frame = self.chunk(b"ANMF", header + bytes([WEBP_NO_BLEND]) + frame_data)
+		self.frames.append(frame)
+		self.length += len(frame)
+
+	def to_bytes(self) -> bytes:
+		width, height = self.size
+		body = b"".join(
+			[
+				b"WEBP",
+				self.chunk(
+					b"VP8X",
+					bytes([0x10 | 0x02, 0, 0, 0]) + (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little"),
+				),  # alpha, animation
+				self.chunk(b"ANIM", bytes(4) + min(self.loops, 0xFFFF).to_bytes(2, "little")),
+				*self.frames,
+			]
+		)
+		return b"RIFF" + len(body).to_bytes(4, "little") + body
+
+
+def check_size(size: int, limit: int | None):
+	if limit is not None and size > limit:
+		raise OutputTooLarge(limit)
+
+
+def timeline(job: RenderJob) -> Iterator[FrameDelta]:
+	"""Every frame of an animated job in order, with the arrow bouncing at the end of each textbox frame."""
+	arrow = get_assets(job.assets).arrow
+	# the arrow bounces 2 pixels up from (299, 119), so this covers every position of it
+	arrow_box = (299, 119 - 2, 299 + arrow.width, 119 + arrow.height)
+
+	under_arrow = None
+	for spec in job.frames:
+		last_frame = yield from draw_frame(spec, job.assets, spec.animated)
+
+		# make the ending thing
+		under_arrow = last_frame.crop(arrow_box)
+		bounce_frames: list = [":3", under_arrow.copy(), under_arrow.copy(), under_arrow.copy()]
+		bounce_frames[1].paste(arrow, (0, 2), arrow)
+		bounce_frames[2].paste(arrow, (0, 2 - 1), arrow)
+		bounce_frames[3].paste(arrow, (0, 2 - 2), arrow)
+
+		for i in bounce(spec.end_arrow_bounces, 3):
+			yield FrameDelta(arrow_box, bounce_frames[i], spec.end_arrow_delay)
+	if under_arrow is not None:
+		yield FrameDelta(arrow_box, under_arrow, 150)
+
+
+def render_job(job: RenderJob) -> bytes:
+	"""
+	Renders and encodes a whole textbox, this is what runs in the render workers.
+
+	Frames go to the encoder as they're drawn, WEBP and APNG stop as soon as they're over `job.max_size`.
+	"""
+	if job.still:
+		image = next(draw_frame(job.frames[0], job.assets, animated=False)).image
+		assert image is not None
+		return encode_still(image, job.filetype, job.quality)
+
+	lowest_fastest = 0
+	match job.filetype:
+		case "WEBP":
+			lowest_fastest = 11
+		case "GIF":
+			lowest_fastest = 20
+		case "APNG":
+			lowest_fastest = 11
+	# flooring the durations, because if it's lower than a certain number the browser/app just slows it down to 100ms i think? i'm not sure
+	# here's a thing one of the developer working on webp said about this
+	# https://groups.google.com/a/webmproject.org/g/webp-discuss/c/Yd0sstcZGlU/m/4PfkB4aVa8cJ?pli=1  # noqa: ERA001
+	#
+	# all of these are the lowest i could get in firefox/android discord app
+	size = get_assets(job.assets).background.size
+	deltas = shrink_deltas(timeline(job), size, lowest_fastest, align=2 if job.filetype == "WEBP" else 1)
+	match job.filetype:
+		case "WEBP":
+			animation = AnimatedWebP(size, loops=job.loops)
+			for delta in deltas:
+				assert delta.image is not None and delta.box is not None
+				animation.append(delta.image, delta.box[:2], delta.duration, job.quality)
+				check_size(animation.length, job.max_size)
+			return animation.to_bytes()
+		case "APNG":
+			animation = apng.APNG(
+				num_plays=job.loops,
+			)
+
+			length = 0
+			for delta in deltas:
+				assert delta.image is not None and delta.box is not None
+				temp_buffer = io.BytesIO()
+				delta.image.save(temp_buffer, format="PNG")
+				length += temp_buffer.tell()
+				check_size(length, job.max_size)
+				animation.append(
+					apng.PNG.from_bytes(temp_buffer.getvalue()),
+					x_offset=delta.box[0],
+					y_offset=delta.box[1],
+					delay=delta.duration,
+					delay_den=1000,
+					depose_op=APNG_DISPOSE_NONE,
+					blend_op=APNG_BLEND_SOURCE,
+				)
+
+			return animation.to_bytes()
+		case "GIF":
+			# Pillow's GIF writer wants every frame before it writes anything, so these only get checked at the end
+			all_deltas = list(deltas)
+			buffer = io.BytesIO()
+			frames = full_frames(all_deltas, size)
+			next(frames).save(
+				buffer,
+				format="GIF",
+				save_all=True,
+				append_images=frames,
+				duration=[delta.duration for delta in all_deltas],
+				optimize=True,
+				loops=job.loops,
+			)
+			check_size(buffer.tell(), job.max_size)
+			return buffer.getvalue()
+	raise ValueError(f"Can't animate {job.filetype}")
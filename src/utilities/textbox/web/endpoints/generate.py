@@ -7,7 +7,9 @@ from aiohttp import web
 from utilities.config import get_config
 from utilities.localization.localization import Localization
 from utilities.misc import io_buffer_bettell
-from utilities.textbox.mediagen import render_textbox_frames
+from utilities.textbox.mediagen import render_error, render_textbox_frames
+from utilities.textbox.render_pool import RenderQueueFull
+from utilities.textbox.renderer import OutputTooLarge
 from utilities.textbox.states import State
 from utilities.textbox.web.misc import get_browser_locale
 
@@ -27,6 +29,7 @@ async def generate_route(request: web.Request):
 			frame_index=int(frame_index) if frame_index is not None else None,
 			loops=state.options.loops,
 			loc=loc,
+			owner=request.remote,
 		)
 
 		file_size = io_buffer_bettell(image_buffer)
@@ -51,6 +54,10 @@ async def generate_route(request: web.Request):
 
 		return web.json_response({"output_blob": data_uri, "took": duration_ms})
 
+	except RenderQueueFull as e:
+		return web.json_response({"error": await render_error(loc, e)}, status=503)
+	except OutputTooLarge as e:
+		return web.json_response({"error": await render_error(loc, e)}, status=413)
 	except Exception as e:
 		print(f"Error during image generation: {e}")
 		import traceback
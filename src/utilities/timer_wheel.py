@@ -0,0 +1,87 @@
+import asyncio
+import inspect
+from math import ceil
+from traceback import print_exc
+from typing import Any, Callable
+
+
+class TimerHandle:
+	__slots__ = ("callback", "rounds", "cancelled", "wheel")
+
+	def __init__(self, wheel: "TimerWheel", callback: Callable[[], Any], rounds: int):
+		self.wheel = wheel
+		self.callback = callback
+		self.rounds = rounds  # full turns of the wheel left before it's due
+		self.cancelled = False
+
+	def cancel(self):
+		if not self.cancelled:
+			self.cancelled = True
+			self.wheel.pending -= 1
+
+
+class TimerWheel:
+	"""
+	Hashed timing wheel: one task ticks every `resolution` seconds and runs the callbacks that are due, so any number
+	of long timers (transmission deadlines, warnings) costs one sleeping task. It stops ticking when nothing's left.
+
+	Callbacks can be sync or return an awaitable, which is run as a task.
+	"""
+
+	def __init__(self, slots: int = 64, resolution: float = 1.0):
+		self.slots: list[list[TimerHandle]] = [[] for _ in range(slots)]
+		self.resolution = resolution
+		self.position = 0
+		self.pending = 0
+		self.fired = 0
+		self._task: asyncio.Task | None = None
+		self._running: set[asyncio.Task] = set()
+
+	def schedule(self, delay: float, callback: Callable[[], Any]) -> TimerHandle:
+		ticks = max(1, ceil(delay / self.resolution))
+		handle = TimerHandle(self, callback, (ticks - 1) // len(self.slots))
+		self.slots[(self.position + ticks) % len(self.slots)].append(handle)
+		self.pending += 1
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._run())
+		return handle
+
+	def _fire(self, handle: TimerHandle):
+		self.fired += 1
+		try:
+			result = handle.callback()
+			if inspect.isawaitable(result):
+				task = asyncio.ensure_future(result)
+				self._running.add(task)
+				task.add_done_callback(self._running.discard)
+		except Exception:
+			print_exc()
+
+	async def _run(self):
+		loop = asyncio.get_running_loop()
+		next_tick = loop.time()
+		while self.pending > 0:
+			next_tick += self.resolution
+			await asyncio.sleep(max(0.0, next_tick - loop.time()))
+			self.position = (self.position + 1) % len(self.slots)
+			due: list[TimerHandle] = []
+			waiting: list[TimerHandle] = []
+			for handle in self.slots[self.position]:
+				if handle.cancelled:
+					continue
+				if handle.rounds > 0:
+					handle.rounds -= 1
+					waiting.append(handle)
+				else:
+					due.append(handle)
+			self.slots[self.position] = waiting
+			for handle in due:
+				self.pending -= 1
+				handle.cancelled = True  # so cancelling it later doesn't count it twice
+				self._fire(handle)
+
+	def stats(self) -> dict[str, int]:
+		return {"pending": self.pending, "fired": self.fired, "running": len(self._running)}
+
+
+timer_wheel = TimerWheel()
@@ -0,0 +1,354 @@
+import asyncio
+import json
+from collections import OrderedDict
+from itertools import count
+from traceback import print_exc
+from typing import Any, Callable, Iterable, TypedDict
+
+from utilities.cluster import encode, in_cluster
+from utilities.config import get_config
+
+LINE_LIMIT = 2**20  # bytes, a relayed message is one line
+
+
+class Entry(TypedDict):
+	server_id: int
+	channel_id: int
+	session: str  # tells apart transmissions that used the same channel
+
+
+Event = dict[str, Any]
+EventHandler = Callable[[int, Event], None]
+
+
+def connected_event(waiter: Entry, claimer: Entry, deadline: float) -> Event:
+	return {"type": "connected", "session": waiter["session"], "peer": claimer, "deadline": deadline}
+
+
+class Matchmaker:
+	"""Servers waiting for a transmission, oldest first."""
+
+	def __init__(self):
+		self.waiting: OrderedDict[int, Entry] = OrderedDict()
+
+	def wait(self, entry: Entry):
+		self.waiting[int(entry["server_id"])] = entry
+
+	def take(self, block_list: Iterable) -> Entry | None:
+		"""Removes and returns the longest waiting server that isn't in `block_list`."""
+		blocked = {str(server_id) for server_id in block_list}
+		for server_id in self.waiting:
+			if str(server_id) not in blocked:
+				return self.waiting.pop(server_id)
+		return None
+
+	def take_or_wait(self, entry: Entry, block_list: Iterable) -> Entry | None:
+		"""`take`, or when nobody can be taken, `entry` starts waiting."""
+		waiter = self.take(block_list)
+		if waiter is None:
+			self.wait(entry)
+		return waiter
+
+	def leave(self, server_id: int) -> bool:
+		return self.waiting.pop(int(server_id), None) is not None
+
+
+class TransmissionBackend:
+	"""
+	Where servers wait to be connected, and how events get to the other side of a transmission.
+
+	Events are published to a channel id and given to `handler` by the process subscribed to that channel. Claiming a
+	waiting server delivers `connected` to it in the same step, so a server leaving at the same time is either taken
+	out of the queue (`leave` returns True) or has already been told it's connected, never neither.
+	"""
+
+	handler: EventHandler | None = None
+
+	async def claim_or_wait(self, entry: Entry, block_list: Iterable, deadline: float) -> Entry | None:
+		"""
+		Connects `entry` to the longest waiting server not in `block_list` and returns that server. When there's none,
+		`entry` waits instead, in the same step so two servers starting at once can't both end up waiting.
+		"""
+		raise NotImplementedError
+
+	async def leave(self, server_id: int) -> bool:
+		"""Whether the server was still waiting."""
+		raise NotImplementedError
+
+	async def subscribe(self, channel_id: int):
+		raise NotImplementedError
+
+	async def unsubscribe(self, channel_id: int):
+		raise NotImplementedError
+
+	async def publish(self, channel_id: int, event: Event):
+		raise NotImplementedError
+
+	async def close(self):
+		pass
+
+	def stats(self) -> dict[str, Any]:
+		return {}
+
+	def _deliver(self, channel_id: int, event: Event):
+		if self.handler is None:
+			return
+		try:
+			self.handler(int(channel_id), event)
+		except Exception:
+			print_exc()
+
+
+class MemoryBackend(TransmissionBackend):
+	"""Everything in this process, so only servers this process sees can be connected to each other."""
+
+	def __init__(self):
+		self.matchmaker = Matchmaker()
+		self.subscribed: set[int] = set()
+
+	async def claim_or_wait(self, entry: Entry, block_list: Iterable, deadline: float) -> Entry | None:
+		waiter = self.matchmaker.take_or_wait(entry, block_list)
+		if waiter is not None:
+			await self.publish(waiter["channel_id"], connected_event(waiter, entry, deadline))
+		return waiter
+
+	async def leave(self, server_id: int) -> bool:
+		return self.matchmaker.leave(server_id)
+
+	async def subscribe(self, channel_id: int):
+		self.subscribed.add(int(channel_id))
+
+	async def unsubscribe(self, channel_id: int):
+		self.subscribed.discard(int(channel_id))
+
+	async def publish(self, channel_id: int, event: Event):
+		if int(channel_id) in self.subscribed:
+			self._deliver(channel_id, event)
+
+	def stats(self) -> dict[str, Any]:
+		return {"waiting": len(self.matchmaker.waiting), "subscribed": len(self.subscribed)}
+
+
+class Broker:
+	"""
+	The shared side of `BrokerBackend`: one process that every bot process connects to, matching waiting servers and
+	passing events along. One JSON object per line, requests are handled one at a time so claiming is atomic.
+
+	When a bot process disconnects, its waiting servers and subscriptions are dropped.
+	"""
+
+	def __init__(self):
+		self.matchmaker = Matchmaker()
+		self.subscribers: dict[int, set[asyncio.StreamWriter]] = {}
+		self.clients = 0
+
+	async def start(self, host: str, port: int) -> asyncio.Server:
+		return await asyncio.start_server(self._client, host, port, limit=LINE_LIMIT)
+
+	async def serve(self, host: str, port: int):
+		server = await self.start(host, port)
+		async with server:
+			await server.serve_forever()
+
+	def _publish(self, channel_id: int, event: Event):
+		for writer in self.subscribers.get(int(channel_id), ()):
+			writer.write(encode({"channel_id": int(channel_id), "event": event}))
+
+	def _handle(self, request: dict, writer: asyncio.StreamWriter, waits: set[int], channels: set[int]) -> Any:
+		match request["op"]:
+			case "claim_or_wait":
+				waiter = self.matchmaker.take_or_wait(request["entry"], request["block_list"])
+				if waiter is None:
+					waits.add(int(request["entry"]["server_id"]))
+				else:
+					self._publish(waiter["channel_id"], connected_event(waiter, request["entry"], request["deadline"]))
+				return waiter
+			case "leave":
+				waits.discard(int(request["server_id"]))
+				return self.matchmaker.leave(request["server_id"])
+			case "subscribe":
+				for channel_id in request["channels"]:
+					self.subscribers.setdefault(int(channel_id), set()).add(writer)
+					channels.add(int(channel_id))
+			case "unsubscribe":
+				self._unsubscribe(int(request["channel_id"]), writer)
+				channels.discard(int(request["channel_id"]))
+			case "publish":
+				self._publish(request["channel_id"], request["event"])
+			case "stats":
+				return self.stats()
+			case op:
+				raise ValueError(f"unknown op {op!r}")
+
+	def _unsubscribe(self, channel_id: int, writer: asyncio.StreamWriter):
+		writers = self.subscribers.get(channel_id)
+		if writers is None:
+			return
+		writers.discard(writer)
+		if not writers:
+			del self.subscribers[channel_id]
+
+	async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		self.clients += 1
+		waits: set[int] = set()
+		channels: set[int] = set()
+		try:
+			while line := await reader.readline():
+				request = json.loads(line)
+				try:
+					reply = {"id": request.get("id"), "result": self._handle(request, writer, waits, channels)}
+				except (KeyError, TypeError, ValueError) as e:
+					reply = {"id": request.get("id"), "error": repr(e)}
+				writer.write(encode(reply))
+				await writer.drain()
+		except (ConnectionError, ValueError):
+			pass
+		finally:
+			self.clients -= 1
+			for server_id in waits:
+				self.matchmaker.leave(server_id)
+			for channel_id in channels:
+				self._unsubscribe(channel_id, writer)
+			writer.close()
+
+	def stats(self) -> dict[str, Any]:
+		return {"waiting": len(self.matchmaker.waiting), "channels": len(self.subscribers), "clients": self.clients}
+
+
+class BrokerBackend(TransmissionBackend):
+	"""
+	Talks to a `Broker`, so servers handled by different bot processes can be connected to each other.
+
+	Connects on first use, and again after the connection drops. Subscriptions are sent again then, but the broker
+	forgot the servers that were waiting, so they get `ended` as cancelled. Requests that were in flight raise
+	`ConnectionError`.
+	"""
+
+	def __init__(self, host: str, port: int):
+		self.host = host
+		self.port = port
+		self.subscribed: set[int] = set()
+		self.waiting: dict[str, Entry] = {}  # by session, until they're connected or leave
+		self._writer: asyncio.StreamWriter | None = None
+		self._reading: asyncio.Task | None = None
+		self._pending: dict[int, asyncio.Future] = {}
+		self._ids = count()
+		self._lock = asyncio.Lock()
+
+	async def _connection(self) -> asyncio.StreamWriter:
+		async with self._lock:
+			if self._writer is None or self._writer.is_closing():
+				reader, writer = await asyncio.open_connection(self.host, self.port, limit=LINE_LIMIT)
+				if self.subscribed:  # the broker forgot them along with the old connection
+					writer.write(encode({"id": None, "op": "subscribe", "channels": list(self.subscribed)}))
+				self._writer = writer
+				self._reading = asyncio.create_task(self._read(reader, writer))
+			return self._writer
+
+	async def _read(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			while line := await reader.readline():
+				message = json.loads(line)
+				if "event" in message:
+					if message["event"].get("type") == "connected":
+						self.waiting.pop(message["event"].get("session"), None)
+					self._deliver(message["channel_id"], message["event"])
+					continue
+				future = self._pending.pop(message["id"], None)
+				if future is None or future.done():
+					continue
+				if "error" in message:
+					future.set_exception(ValueError(message["error"]))
+				else:
+					future.set_result(message.get("result"))
+		except (ConnectionError, ValueError):
+			print_exc()
+		finally:
+			writer.close()
+			if self._writer is writer:
+				self._writer = None
+			for future in self._pending.values():
+				if not future.done():
+					future.set_exception(ConnectionError("lost the connection to the transmission broker"))
+			self._pending.clear()
+			if self._writer is None:  # not already replaced by a new connection
+				self._lost_waiting()
+
+	def _lost_waiting(self):
+		"""The broker drops the servers waiting through a connection along with it, they can't be connected anymore."""
+		lost = list(self.waiting.values())
+		self.waiting.clear()
+		for entry in lost:
+			self._deliver(entry["channel_id"], {"type": "ended", "session": entry["session"], "reason": "cancelled"})
+
+	async def _request(self, op: str, **args) -> Any:
+		writer = await self._connection()
+		request_id = next(self._ids)
+		future = asyncio.get_running_loop().create_future()
+		self._pending[request_id] = future
+		writer.write(encode({"id": request_id, "op": op, **args}))
+		await writer.drain()
+		return await future
+
+	async def claim_or_wait(self, entry: Entry, block_list: Iterable, deadline: float) -> Entry | None:
+		# tracked before asking, `connected` can be read before the reply is
+		self.waiting[entry["session"]] = entry
+		try:
+			waiter = await self._request(
+				"claim_or_wait", entry=entry, block_list=[str(id) for id in block_list], deadline=deadline
+			)
+		except BaseException:
+			self.waiting.pop(entry["session"], None)
+			raise
+		if waiter is not None:
+			self.waiting.pop(entry["session"], None)
+		return waiter
+
+	async def leave(self, server_id: int) -> bool:
+		for session, entry in list(self.waiting.items()):
+			if int(entry["server_id"]) == int(server_id):
+				del self.waiting[session]
+		return await self._request("leave", server_id=int(server_id))
+
+	async def subscribe(self, channel_id: int):
+		self.subscribed.add(int(channel_id))
+		await self._request("subscribe", channels=[int(channel_id)])
+
+	async def unsubscribe(self, channel_id: int):
+		self.subscribed.discard(int(channel_id))
+		await self._request("unsubscribe", channel_id=int(channel_id))
+
+	async def publish(self, channel_id: int, event: Event):
+		await self._request("publish", channel_id=int(channel_id), event=event)
+
+	async def close(self):
+		if self._writer is not None:
+			self._writer.close()
+			self._writer = None
+		if self._reading is not None:
+			self._reading.cancel()
+
+	def stats(self) -> dict[str, Any]:
+		return {
+			"subscribed": len(self.subscribed),
+			"waiting": len(self.waiting),
+			"in_flight": len(self._pending),
+			"connected": self._writer is not None and not self._writer.is_closing(),
+		}
+
+
+def broker_address() -> tuple[str, int]:
+	host, _, port = (get_config("transmissions.broker", ignore_None=True) or "127.0.0.1:4232").rpartition(":")
+	return host, int(port)
+
+
+def make_backend() -> TransmissionBackend:
+	# shards in a cluster are separate processes, the supervisor hosts the broker for them
+	if in_cluster() or get_config("transmissions.backend", ignore_None=True) == "broker":
+		return BrokerBackend(*broker_address())
+	return MemoryBackend()
+
+
+async def run_broker():
+	host, port = broker_address()
+	await Broker().serve(host, port)
@@ -1,12 +1,31 @@
-from typing import Union
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, Literal
 
-from interactions import Snowflake
+from interactions import Client, Snowflake
+
+from utilities.database.schemas import ServerData
+from utilities.timer_wheel import TimerHandle, timer_wheel
+from utilities.transmission_backend import Entry, Event, TransmissionBackend, make_backend
+
+TRANSMISSION_LENGTH = 600  # seconds a transmission lasts once both sides are connected
+
+EndReason = Literal["cancelled", "disconnected", "timeout"]
 
 
 class Connection:
-	def __init__(self, server_id, channel_id):
+	"""
+	One side of a transmission, and what relaying messages from it needs.
+
+	`load` fills in the channel and the server's transmission settings once per session, so relaying a message doesn't
+	touch the database or the API.
+	"""
+
+	def __init__(self, server_id, channel_id, session: str | None = None):
 		self.server_id = server_id
 		self.channel_id = channel_id
+		self.session = session or uuid.uuid4().hex
 		self.characters = [  # TODO: import from textbox characters
 			{"id": 0, "Image": 1019605517695463484, "Name": "Niko"},
 			{"id": 0, "Image": 1071085652327813212, "Name": "Alula"},
@@ -16,53 +35,191 @@ class Connection:
 			{"id": 0, "Image": 1090982149659836466, "Name": "Ling"},
 			{"id": 0, "Image": 1023573456664662066, "Name": "The World Machine"},
 		]
+		self.channel: Any = None
+		self.anonymous = False
+		self.allow_images = True
+		self._loading: asyncio.Task | None = None
+
+	@classmethod
+	def from_entry(cls, entry: Entry) -> "Connection":
+		return cls(entry["server_id"], entry["channel_id"], entry["session"])
+
+	def entry(self) -> Entry:
+		return {"server_id": int(self.server_id), "channel_id": int(self.channel_id), "session": self.session}
+
+	def load(self, client: Client) -> asyncio.Task:
+		"""Every call in a session gets the same task, so the channel and settings are only fetched once."""
+		if self._loading is None or (self._loading.done() and self._loading.exception() is not None):
+			self._loading = asyncio.create_task(self._load(client))
+		return self._loading
+
+	async def _load(self, client: Client):
+		server_data, self.channel = await asyncio.gather(
+			ServerData(_id=self.server_id).fetch(), client.fetch_channel(self.channel_id)
+		)
+		self.anonymous = server_data.transmissions.anonymous
+		self.allow_images = server_data.transmissions.allow_images
 
 
 class Transmission:
-	def __init__(self, a: Connection, b: Union[Connection, None]):
-		self.connection_a = a
-		self.connection_b = b
+	"""
+	This server's side of a transmission: waiting until `connected` is set, then connected to `peer` until `ended` is.
+
+	The peer may be handled by another bot process, so everything between the two sides goes through the `backend`.
+	Both sides time out by themselves, with a timer on the shared `timer_wheel`.
+	"""
+
+	def __init__(self, connection: Connection):
+		self.connection = connection
+		self.peer: Connection | None = None
+		self.connected = asyncio.Event()
+		self.ended = asyncio.Event()
+		self.end_reason: EndReason | None = None
+		self.deadline: float | None = None  # time.time() of when it times out
+		self._timeout: TimerHandle | None = None
+
+	def start(self, peer: Connection, deadline: float):
+		self.peer = peer
+		self.deadline = deadline
+		self._timeout = timer_wheel.schedule(deadline - time.time(), lambda: end_transmission(self, "timeout"))
+		self.connected.set()
+
+	def end(self, reason: EndReason):
+		if self.ended.is_set():
+			return
+		if self._timeout is not None:
+			self._timeout.cancel()
+		self.end_reason = reason
+		self.ended.set()
 
 
-transmissions: list[Transmission] = []
+# this process's sides of transmissions, under their server and channel
+by_server: dict[int, Transmission] = {}
+by_channel: dict[int, Transmission] = {}
 
+backend: TransmissionBackend
+# sends a message relayed from the peer into the channel, set by the transmit extension
+relay: Callable[[Transmission, Event], Awaitable[Any]] | None = None
+_tasks: set[asyncio.Task] = set()
 
-def create_connection(server_id: Snowflake, channel_id: Snowflake) -> Transmission:
-	conn = Connection(server_id, channel_id)
-	trans = Transmission(conn, None)
-	transmissions.append(trans)
+
+def _spawn(coroutine: Coroutine):
+	task = asyncio.create_task(coroutine)
+	_tasks.add(task)
+	task.add_done_callback(_tasks.discard)
+
+
+async def _unsubscribe(channel_id: int):
+	# a new transmission could have started in the channel in the meantime
+	if int(channel_id) not in by_channel:
+		await backend.unsubscribe(channel_id)
+
+
+def _forget(trans: Transmission):
+	connection = trans.connection
+	if by_server.get(int(connection.server_id)) is trans:
+		del by_server[int(connection.server_id)]
+	if by_channel.get(int(connection.channel_id)) is trans:
+		del by_channel[int(connection.channel_id)]
+		_spawn(_unsubscribe(connection.channel_id))
+
+
+def on_event(channel_id: int, event: Event):
+	trans = by_channel.get(channel_id)
+	if trans is None or trans.connection.session != event.get("session") or trans.ended.is_set():
+		return
+	match event["type"]:
+		case "connected":
+			trans.start(Connection.from_entry(event["peer"]), event["deadline"])
+		case "ended":
+			_forget(trans)
+			trans.end(event["reason"])
+		case "message":
+			if relay is not None:
+				_spawn(relay(trans, event))
+
+
+def set_backend(new: TransmissionBackend):
+	global backend
+	backend = new
+	backend.handler = on_event
+
+
+set_backend(make_backend())
+
+
+async def start_transmission(server_id: Snowflake, channel_id: Snowflake, block_list: Iterable = ()) -> Transmission:
+	"""
+	Connects to the longest waiting server that isn't in `block_list`, then `connected` is already set on the returned
+	transmission. Otherwise it waits for another server to connect to it, or ends as cancelled if the backend loses it.
+	"""
+	trans = Transmission(Connection(server_id, channel_id))
+	by_server[int(server_id)] = trans
+	by_channel[int(channel_id)] = trans
+	try:
+		await backend.subscribe(channel_id)
+		deadline = time.time() + TRANSMISSION_LENGTH
+		waiter = await backend.claim_or_wait(trans.connection.entry(), block_list, deadline)
+		if waiter is not None:
+			trans.start(Connection.from_entry(waiter), deadline)
+	except BaseException:
+		_forget(trans)
+		raise
 	return trans
 
 
-def remove_connection(server_id: Snowflake | Transmission):
-	trans = get_transmission(server_id)
-	if trans is None:
+async def end_transmission(trans: Snowflake | Transmission, reason: EndReason = "disconnected"):
+	"""Ends this side, and lets the peer know. A transmission that never connected ends as cancelled."""
+	trans = get_transmission(trans)
+	if trans is None or trans.ended.is_set():
 		return
-	trans.connection_b = None
-	transmissions.remove(trans)
+	try:
+		if not trans.connected.is_set():
+			# when it was claimed in the meantime, `connected` arrived before this returns
+			await backend.leave(trans.connection.server_id)
+	finally:
+		_forget(trans)
+	if trans.ended.is_set():
+		return
+	if not trans.connected.is_set() or trans.peer is None:
+		trans.end("cancelled")
+		return
+	trans.end(reason)
+	if reason != "timeout":  # the peer times out by itself
+		await backend.publish(trans.peer.channel_id, {"type": "ended", "session": trans.peer.session, "reason": reason})
 
 
-def connect_to_transmission(server_id, channel_id):
-	for transmission in transmissions:
-		if transmission.connection_b is None:
-			transmission.connection_b = Connection(server_id, channel_id)
-			return
+async def relay_message(trans: Transmission, embed: dict):
+	"""Sends an embed (as a dict) to the peer's channel."""
+	if trans.peer is None:
+		return
+	await backend.publish(trans.peer.channel_id, {"type": "message", "session": trans.peer.session, "embed": embed})
+
+
+def set_relay(handler: Callable[[Transmission, Event], Awaitable[Any]]):
+	global relay
+	relay = handler
+
+
+async def close_backend():
+	await backend.close()
 
 
 def get_transmission(server_id: Snowflake | Transmission) -> Transmission | None:
 	if isinstance(server_id, Transmission):
 		return server_id
-	for transmission in transmissions:
-		for connection in [transmission.connection_a, transmission.connection_b]:
-			if connection and connection.server_id == server_id:
-				return transmission
+	return by_server.get(int(server_id))
+
+
+def get_channel_transmission(channel_id: Snowflake) -> Transmission | None:
+	return by_channel.get(int(channel_id))
 
 
 def connection_alive(transmission: Snowflake | Transmission) -> bool:
 	trans = get_transmission(transmission)
 	if trans is None:
 		return False
-	if trans.connection_b == None:
+	if trans.peer == None:
 		return False
 	return True
 
@@ -71,27 +228,8 @@ def attempting_to_connect(server_id: Snowflake | Transmission) -> bool:
 	trans = get_transmission(server_id)
 	if trans is None:
 		return False
-	return trans.connection_b is None
+	return trans.peer is None
 
 
-def available_initial_connections(block_list) -> bool:
-	for transmission in transmissions:
-		if transmission.connection_b is None:
-			if transmission.connection_a.server_id in block_list:
-				continue
-
-			return False
-
-	return True
-
-
-def check_if_connected(server_id: Snowflake | Transmission) -> bool:
-	trans = get_transmission(server_id)
-	if trans is None:
-		return False
-	if trans.connection_b is None:
-		return False
-	elif trans.connection_b.server_id == server_id:
-		return True
-
-	return False
+def stats() -> dict[str, Any]:
+	return {"local": len(by_server), **backend.stats()}